@@ -0,0 +1,64 @@
+"""测量排队条目的内存占用
+
+用法：
+    python benchmark_queue_entry.py
+    python benchmark_queue_entry.py --entries 100000 --users 20000
+
+模拟从持久化存储加载的 JSON 数据，用 tracemalloc 分别测量保留原始字典和转换为
+QueueEntry（__slots__ + 字符串驻留）后每个条目占用的字节数。
+用户ID和昵称在 --users 个用户之间循环，与多个群聊中同一批用户反复排队的情况一致。
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from queue_entry import QueueEntry
+
+
+def build_payload(entries, users):
+    """生成与持久化格式一致的 JSON 文本"""
+    return json.dumps([
+        {
+            "user_id": str(10000000 + i % users),
+            "user_name": f"用户{i % users}",
+            "position": i % 50 + 1,
+            "join_time": 1790000000 + i,
+        }
+        for i in range(entries)
+    ], ensure_ascii=False)
+
+
+def measure(payload, convert):
+    """返回解析并转换 payload 后保留的内存字节数"""
+    gc.collect()
+    tracemalloc.start()
+    result = convert(json.loads(payload))
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description="测量排队条目的内存占用")
+    parser.add_argument("--entries", type=int, default=100000, help="排队条目数")
+    parser.add_argument("--users", type=int, default=20000, help="不同用户数")
+    args = parser.parse_args()
+
+    payload = build_payload(args.entries, args.users)
+    as_dicts = measure(payload, lambda data: data)
+    as_entries = measure(payload, lambda data: [QueueEntry.from_dict(item) for item in data])
+    print(f"{args.entries} 个条目，{args.users} 个不同用户")
+    print(f"字典：        {as_dicts / args.entries:>8.0f} B/条目")
+    print(f"QueueEntry：  {as_entries / args.entries:>8.0f} B/条目")
+    print(f"节省：        {(1 - as_entries / as_dicts) * 100:>8.1f}%")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class CachedResult:
+    """一次指令执行产生的全部回复，执行完成前重复请求会等待 done
+
+    执行失败时 failed 为 True，results 不完整，等待方应重新执行指令。
+    """
+
+    __slots__ = ("results", "done", "expires_at", "failed")
+
+    def __init__(self, expires_at):
+        self.results = []
+        self.done = asyncio.Event()
+        self.expires_at = expires_at
+        self.failed = False
+
+
+class DedupCache:
+    """有容量上限的 LRU/TTL 去重缓存
+
+    所有操作均为 O(1)；超过容量时淘汰最久未使用的记录，过期记录在访问时惰性清除。
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max(1, int(max_size))
+        self._entries = OrderedDict()
+        self.suppressed = 0  # 被拦截的重复指令次数
+        self.evicted = 0  # 因容量上限被淘汰的记录数
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """查找未过期的记录，是否计为拦截由调用方在确认重放后决定"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, ttl):
+        """为 key 创建新的记录并返回，调用方负责填充结果"""
+        now = time.monotonic()
+        entry = CachedResult(now + ttl)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        # 先清除队首已过期的记录，再按容量淘汰
+        while self._entries:
+            oldest_key, oldest = next(iter(self._entries.items()))
+            if oldest.expires_at > now and len(self._entries) <= self.max_size:
+                break
+            self._entries.popitem(last=False)
+            if oldest.expires_at > now:
+                self.evicted += 1
+        return entry
+
+    def discard(self, key, entry):
+        """执行失败时移除记录并标记失败，使后续及正在等待的请求重新执行"""
+        entry.failed = True
+        if self._entries.get(key) is entry:
+            del self._entries[key]
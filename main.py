@@ -2,11 +2,24 @@ from astrbot.api.event import filter, AstrMessageEvent
 from astrbot.api.star import Context, Star, register
 from astrbot.api import logger
 from astrbot.api import AstrBotConfig
+import os
+import re
 import time
 import asyncio
+import functools
+import secrets
+from collections import OrderedDict
 from datetime import datetime, time as dt_time
 import astrbot.api.message_components as Comp
 
+from .queue_entry import QueueEntry, intern_value
+from .queue_snapshot import GroupSnapshot, EMPTY_SNAPSHOT, PREVIEW_SIZE
+from .dedup_cache import DedupCache
+from .shared_store import SharedQueueStore
+from .tracing import Tracer
+from .traffic_recorder import TrafficRecorder
+from .queue_transfer import export_header, format_group_lines, parse_import_line, IMPORT_COMPLETED_BATCH
+
 # 暖色调的自定义HTML模板
 BEAUTIFUL_QUEUE_TEMPLATE = '''
 <!DOCTYPE html>
@@ -279,6 +292,8 @@ HELP_TEMPLATE = '''
             <div class="command-item"><strong>• /跳过</strong> - 跳过队列中的第一位用户{{ permission_text }}</div>
             <div class="command-item"><strong>• /清空队列</strong> - 清空当前群聊的队列和已完成记录{{ permission_text }}</div>
             <div class="command-item"><strong>• /清空所有队列</strong> - 清空所有群聊的队列和已完成记录 (需要高级管理员权限)</div>
+            <div class="command-item"><strong>• /导出队列 [全部]</strong> - 导出当前群聊（或所有群聊）的队列 (需要高级管理员权限)</div>
+            <div class="command-item"><strong>• /导入队列 文件名 [全部]</strong> - 从导出目录批量导入队列 (需要高级管理员权限)</div>
         </div>
         
         <div class="config-section">
@@ -292,13 +307,59 @@ HELP_TEMPLATE = '''
 </html>
 '''
 
+def idempotent(command):
+    """将变更类指令包装为幂等指令：重复投递的消息直接返回首次执行的结果，不再修改队列
+
+    指令参数是去重键的一部分，参数不同的连续指令不会被视为重复。
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(self, event: AstrMessageEvent, *args, **kwargs):
+            arguments = args + tuple(sorted(kwargs.items()))
+            async for result in self.run_idempotent(event, command, handler(self, event, *args, **kwargs), arguments):
+                yield result
+        return wrapper
+    return decorator
+
+def instrumented(command):
+    """为指令处理记录采样链路和匿名流量，两者都未启用时直接执行"""
+    trace_name = f"/{command}"
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(self, event: AstrMessageEvent, *args, **kwargs):
+            # 未启用时不构建任何链路参数，只多两次属性读取
+            if not self.tracer.enabled and not self.recorder.enabled:
+                async for result in handler(self, event, *args, **kwargs):
+                    yield result
+                return
+            started = time.time()
+            trace = None
+            if self.tracer.enabled:
+                trace = self.tracer.start_trace(trace_name, group_id=str(self.get_group_id(event)))
+            try:
+                async for result in handler(self, event, *args, **kwargs):
+                    yield result
+            finally:
+                if trace is not None:
+                    self.tracer.finish_trace(trace)
+                if self.recorder.enabled:
+                    self.record_traffic(event, command, started)
+        return wrapper
+    return decorator
+
 @register("queue_system", "mogudunxy", "排队系统插件", "1.2.0")
 class QueuePlugin(Star):
     def __init__(self, context: Context, config: AstrBotConfig = None):
         super().__init__(context)
         self.config = config if config else {}
-        self.queues = {}  # 按群聊ID分别存储队列 {group_id: queue}
-        self.completed_users = {}  # 按群聊ID存储已完成用户 {group_id: [user_names]}
+        self.queues = {}  # 按群聊ID分别存储队列 {group_id: [QueueEntry]}
+        self.completed_users = {}  # 按群聊ID存储已完成用户 {group_id: [user_names]}，昵称已驻留
+        self.group_versions = {}  # 按群聊ID记录数据版本 {group_id: version}，每次修改后递增
+        self.snapshots = {}  # 按群聊ID发布的只读快照 {group_id: GroupSnapshot}，读取指令只访问快照
+        self.group_locks = {}  # 按群聊ID串行化本进程内的修改 {group_id: asyncio.Lock}
+        self.persisted_groups = set()  # 键值存储中保存了数据的群聊ID
+        self.pending_persist = {}  # 后台持久化尚未完成的群聊 {group_id: 最后一个持久化任务}，完成前不从内存中移除
+        self.version_seq = 0
         
         # 从配置中获取设置，如果没有配置则使用默认值
         self.enable_call_permission = self.config.get("enable_call_permission", False)
@@ -317,12 +378,67 @@ class QueuePlugin(Star):
         self.completed_label = self.config.get("completed_label", "已完成")
         self.waiting_label = self.config.get("waiting_label", "等待中")
         
+        # 位置提醒配置：队列前移后，排到这些位置的用户会收到@提醒
+        self.enable_position_notify = self.config.get("enable_position_notify", False)
+        self.notify_positions = self.parse_notify_positions(self.config.get("notify_positions", [1, 3]))
+        self.position_notify_message = self.config.get("position_notify_message", "你现在排在第{position}位，请做好准备")
+        self.next_notify_message = self.config.get("next_notify_message", "下一位就是你了，请做好准备")
+        
         # 重复排队配置
         self.allow_requeue = self.config.get("allow_requeue", False)
         
         # 高级管理员配置
         self.admin_users = self.config.get("admin_users", [])
         
+        # 重复指令拦截配置
+        self.enable_dedup = self.config.get("enable_dedup", True)
+        self.dedup_window_seconds = self.config.get("dedup_window_seconds", 2)
+        self.dedup_ttl_seconds = self.config.get("dedup_ttl_seconds", 60)
+        self.dedup_cache = DedupCache(self.config.get("dedup_cache_size", 1024))
+        
+        # 多进程共享状态配置
+        self.enable_shared_state = self.config.get("enable_shared_state", False)
+        self.shared_state_path = self.config.get("shared_state_path", "data/queue_system_shared.db")
+        self.shared_store = SharedQueueStore(self.shared_state_path) if self.enable_shared_state else None
+        
+        # 链路追踪配置
+        self.tracer = Tracer(
+            enabled=self.config.get("enable_tracing", False),
+            sample_rate=self.config.get("trace_sample_rate", 0.1),
+            path=self.config.get("trace_file", "data/queue_system_trace.json"),
+            max_bytes=self.config.get("trace_max_bytes", 10 * 1024 * 1024),
+            backup_count=self.config.get("trace_backup_count", 3),
+        )
+        
+        # 流量录制配置，盐未配置时在初始化时生成并保存
+        self.recorder = TrafficRecorder(
+            enabled=self.config.get("enable_traffic_recording", False),
+            path=self.config.get("traffic_record_file", "data/queue_system_traffic.jsonl"),
+            salt=self.config.get("traffic_record_salt", ""),
+            session={
+                "max_queue_size": self.max_queue_size,
+                "allow_requeue": self.allow_requeue,
+                "enable_call_permission": self.enable_call_permission,
+            },
+        )
+        
+        # 叫号流水线配置：先发送@通知，持久化与渲染并行，并预渲染下一次叫号后的状态
+        self.enable_pipelined_call = self.config.get("enable_pipelined_call", False)
+        self.speculative_renders = {}  # {group_id: (version, render_task)}
+        self.speculation_hits = 0
+        self.speculation_misses = 0
+        
+        # 渲染图片缓存：{(group_id, version, view): render_task}，同一版本的同一视图只渲染一次
+        self.render_cache = OrderedDict()
+        self.render_cache_size = self.config.get("render_cache_size", 256)
+        self.render_cache_hits = 0
+        
+        # 导入导出文件所在目录
+        self.export_dir = self.config.get("export_dir", "data/queue_system_exports")
+        
+        # 内存中最多缓存的群聊数，超出时淘汰最久未使用的群聊，0 表示不限制
+        self.max_cached_groups = self.config.get("max_cached_groups", 1000)
+        
         # 启动定时清除任务
         self.clear_task = None
         if self.enable_auto_clear:
@@ -332,51 +448,589 @@ class QueuePlugin(Star):
         """插件初始化方法"""
         # 从持久化存储中恢复队列数据
         await self.load_queues_from_storage()
+        # 流量录制的盐需要跨重启保持不变，同一用户的哈希值才能前后一致
+        if self.recorder.enabled and not self.recorder.salt:
+            salt = await self.get_kv_data("traffic_record_salt", "")
+            if not salt:
+                salt = secrets.token_hex(16)
+                await self.put_kv_data("traffic_record_salt", salt)
+            self.recorder.salt = salt
         logger.info("排队系统插件已初始化")
     
     async def load_queues_from_storage(self):
-        """从持久化存储中加载队列数据"""
+        """从持久化存储中加载队列数据
+
+        只加载群聊索引，各群聊的数据在首次访问时按需加载。
+        """
         try:
-            # 加载队列数据
-            queues_data = await self.get_kv_data("queues", {})
-            if queues_data:
-                self.queues = queues_data
-                logger.info(f"从存储中恢复了 {len(self.queues)} 个群聊的队列数据")
+            # 共享状态模式下，群聊数据通过版本号按需从共享存储加载
+            if self.shared_store:
+                logger.info(f"已连接共享存储：{self.shared_state_path}")
+                return
+            
+            # 迁移旧版本的整体存储
+            await self.migrate_legacy_storage()
             
-            # 加载已完成用户数据
-            completed_data = await self.get_kv_data("completed_users", {})
-            if completed_data:
-                self.completed_users = completed_data
-                logger.info(f"从存储中恢复了已完成用户记录")
+            # 加载群聊索引
+            self.persisted_groups = set(await self.get_kv_data("queue_groups", []))
+            logger.info(f"存储中共有 {len(self.persisted_groups)} 个群聊的队列数据，将在首次访问时加载")
             
         except Exception as e:
             logger.error(f"加载队列数据时出错：{e}")
             # 如果加载失败，初始化为空字典
             self.queues = {}
             self.completed_users = {}
+            self.persisted_groups = set()
+    
+    async def migrate_legacy_storage(self):
+        """将旧版本整体保存的 queues / completed_users 拆分为按群聊存储"""
+        queues_data = await self.get_kv_data("queues", {})
+        completed_data = await self.get_kv_data("completed_users", {})
+        if not queues_data and not completed_data:
+            return
+        
+        persisted_groups = set(await self.get_kv_data("queue_groups", []))
+        migrated = 0
+        for group_id in set(queues_data) | set(completed_data):
+            queue_data = queues_data.get(group_id, [])
+            group_completed = completed_data.get(group_id, [])
+            # 空群聊不再保存
+            if not queue_data and not group_completed:
+                continue
+            await self.put_kv_data(self.group_storage_key(group_id), {"queue": queue_data, "completed": group_completed})
+            persisted_groups.add(group_id)
+            migrated += 1
+        
+        await self.put_kv_data("queue_groups", list(persisted_groups))
+        await self.delete_kv_data("queues")
+        await self.delete_kv_data("completed_users")
+        logger.info(f"已将 {migrated} 个群聊的队列数据迁移为按群聊存储")
+    
+    def group_storage_key(self, group_id):
+        """单个群聊在键值存储中的键名"""
+        return f"queue_group:{group_id}"
     
-    async def save_queues_to_storage(self):
-        """将队列数据保存到持久化存储"""
+    async def save_group_to_storage(self, group_id):
+        """将单个群聊的数据保存到持久化存储，空群聊直接从存储中删除"""
         try:
-            # 保存队列数据
-            await self.put_kv_data("queues", self.queues)
-            # 保存已完成用户数据
-            await self.put_kv_data("completed_users", self.completed_users)
-            logger.debug("队列数据已保存到持久化存储")
+            queue = self.queues.get(group_id, [])
+            completed = self.completed_users.get(group_id, [])
+            if queue or completed:
+                # 条目在此处转换为字典
+                group_data = {
+                    "queue": [person.to_dict() for person in queue],
+                    "completed": list(completed)
+                }
+                await self.put_kv_data(self.group_storage_key(group_id), group_data)
+                if group_id not in self.persisted_groups:
+                    self.persisted_groups.add(group_id)
+                    await self.put_kv_data("queue_groups", list(self.persisted_groups))
+            else:
+                await self.delete_kv_data(self.group_storage_key(group_id))
+                if group_id in self.persisted_groups:
+                    self.persisted_groups.discard(group_id)
+                    await self.put_kv_data("queue_groups", list(self.persisted_groups))
+            logger.debug(f"群聊{group_id}的队列数据已保存到持久化存储")
         except Exception as e:
             logger.error(f"保存队列数据时出错：{e}")
     
     async def clear_storage_data(self):
         """清除持久化存储的队列数据"""
         try:
-            await self.delete_kv_data("queues")
-            await self.delete_kv_data("completed_users")
+            self.group_versions.clear()
+            if self.shared_store:
+                await self.run_blocking(self.shared_store.clear_all)
+                logger.info("共享存储的队列数据已清除")
+                return
+            for group_id in list(self.persisted_groups):
+                await self.delete_kv_data(self.group_storage_key(group_id))
+            self.persisted_groups.clear()
+            await self.delete_kv_data("queue_groups")
             logger.info("持久化存储的队列数据已清除")
         except Exception as e:
             logger.error(f"清除存储数据时出错：{e}")
     
 
 
+    async def run_blocking(self, func, *args):
+        """在线程池中执行阻塞操作（共享存储、文件读写）"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args))
+
+    def next_version(self):
+        """键值存储模式下的全局递增版本号，删除后重建的群聊不会复用旧版本号"""
+        self.version_seq += 1
+        return self.version_seq
+
+    def set_group_state(self, group_id, version, queue_data, completed_data):
+        """用持久化的字典数据替换内存中的群聊状态"""
+        if not queue_data and not completed_data:
+            self.drop_group(group_id)
+            return
+        self.queues.pop(group_id, None)
+        self.queues[group_id] = [QueueEntry.from_dict(item) for item in queue_data]
+        self.completed_users[group_id] = [intern_value(name) for name in completed_data]
+        self.group_versions[group_id] = version
+        self.publish_snapshot(group_id)
+        self.evict_idle_groups()
+
+    def publish_snapshot(self, group_id):
+        """为群聊当前的数据发布新快照并返回，只能在修改完成后（持有群聊锁或加载时）调用"""
+        snapshot = GroupSnapshot(
+            self.group_versions.get(group_id, 0),
+            self.queues.get(group_id, ()),
+            self.completed_users.get(group_id, ()),
+        )
+        self.snapshots[group_id] = snapshot
+        return snapshot
+
+    def get_group_snapshot(self, group_id):
+        """获取群聊最新发布的快照，群聊没有数据时返回空快照"""
+        return self.snapshots.get(group_id, EMPTY_SNAPSHOT)
+
+    def touch_group(self, group_id):
+        """将群聊标记为最近使用，self.queues 的插入顺序即 LRU 顺序"""
+        queue = self.queues.pop(group_id, None)
+        if queue is not None:
+            self.queues[group_id] = queue
+
+    def drop_group(self, group_id):
+        """从内存中移除群聊状态，不影响持久化存储
+
+        后台持久化尚未完成的群聊保留在内存中，由持久化任务完成后再移除，
+        否则持久化任务会把空数据写入存储，或者下次访问时加载到尚未更新的旧数据。
+        """
+        if group_id in self.pending_persist:
+            return
+        self.queues.pop(group_id, None)
+        self.completed_users.pop(group_id, None)
+        self.group_versions.pop(group_id, None)
+        self.snapshots.pop(group_id, None)
+        self.discard_speculative_render(group_id)
+        lock = self.group_locks.get(group_id)
+        if lock and not lock.locked():
+            del self.group_locks[group_id]
+
+    def evict_idle_groups(self):
+        """内存中的群聊数超过上限时，淘汰最久未使用的群聊
+
+        数据在每次修改后都已持久化，被淘汰的群聊再次访问时会重新加载。
+        """
+        overflow = len(self.queues) - self.max_cached_groups
+        if self.max_cached_groups <= 0 or overflow <= 0:
+            return
+        victims = []
+        for group_id in self.queues:
+            if len(victims) >= overflow:
+                break
+            # 正在修改中或等待后台持久化的群聊不淘汰
+            lock = self.group_locks.get(group_id)
+            if (lock and lock.locked()) or group_id in self.pending_persist:
+                continue
+            victims.append(group_id)
+        for group_id in victims:
+            self.drop_group(group_id)
+        logger.debug(f"已从内存中淘汰 {len(victims)} 个不活跃的群聊")
+
+    async def refresh_group(self, group_id):
+        """确保内存中的群聊数据是最新的
+
+        键值存储模式下，已持久化但尚未加载（或已被淘汰）的群聊按需加载，加载失败时抛出异常，
+        避免调用方在空数据上修改后覆盖存储中的数据；
+        共享状态模式下，若其他进程已修改该群聊则重新加载。
+        """
+        if group_id in self.queues:
+            self.touch_group(group_id)
+            if not self.shared_store:
+                return
+        
+        if not self.shared_store:
+            if group_id not in self.persisted_groups:
+                return
+            try:
+                group_data = await self.get_kv_data(self.group_storage_key(group_id), None)
+            except Exception as e:
+                logger.error(f"加载群聊{group_id}的队列数据时出错：{e}")
+                raise
+            # 等待期间可能已被其他协程加载并修改，此时不能用旧数据覆盖
+            if group_id in self.queues:
+                return
+            if not group_data:
+                self.persisted_groups.discard(group_id)
+                return
+            self.set_group_state(group_id, self.next_version(), group_data.get("queue", []), group_data.get("completed", []))
+            return
+        
+        known_version = self.group_versions.get(group_id, 0)
+        try:
+            changed = await self.run_blocking(self.shared_store.load_group_if_changed, group_id, known_version)
+        except Exception as e:
+            logger.error(f"从共享存储加载群聊{group_id}时出错：{e}")
+            return
+        # 等待期间本进程已更新过该群聊时，以较新的内存数据为准
+        if changed is not None and self.group_versions.get(group_id, 0) == known_version:
+            self.set_group_state(group_id, *changed)
+
+    async def persist_group(self, group_id):
+        """持久化单个群聊的修改，共享状态模式下遇到版本冲突时返回 False
+
+        共享存储提交出错时，内存中已修改的数据会被丢弃（下次访问时重新加载），并抛出异常。
+        """
+        if not self.shared_store:
+            self.group_versions[group_id] = self.next_version()
+            with self.tracer.span("save_group_to_storage"):
+                await self.save_group_to_storage(group_id)
+            return True
+        
+        queue_data = [person.to_dict() for person in self.queues.get(group_id, [])]
+        completed_data = list(self.completed_users.get(group_id, []))
+        try:
+            with self.tracer.span("commit_shared_store"):
+                new_version = await self.run_blocking(
+                    self.shared_store.commit_group, group_id, self.group_versions.get(group_id, 0), queue_data, completed_data
+                )
+        except Exception as e:
+            logger.error(f"保存队列数据时出错：{e}")
+            self.drop_group(group_id)
+            raise
+        if new_version is None:
+            return False
+        self.group_versions[group_id] = new_version
+        logger.debug(f"群聊{group_id}的队列数据已提交到共享存储，版本 {new_version}")
+        return True
+
+    async def mutate_queue(self, group_id, mutation):
+        """修改群聊队列并持久化，返回 (snapshot, outcome)
+
+        mutation(queue, completed) 原地修改队列并返回 (changed, outcome)。
+        持久化完成后才发布新快照，读取指令在此期间看到的仍是修改前的完整状态。
+        共享状态模式下提交遇到版本冲突时，会丢弃已修改的内存数据、重新加载最新数据后再次执行 mutation，
+        因此 mutation 只能修改传入的队列，不能有其他副作用。
+        加载或重新加载群聊数据失败时抛出异常，不会在空数据或已修改的数据上执行 mutation。
+        修改后队列和已完成记录都为空的群聊会从内存和存储中移除。
+        """
+        lock = self.group_locks.setdefault(group_id, asyncio.Lock())
+        async with lock:
+            while True:
+                with self.tracer.span("refresh_group"):
+                    await self.refresh_group(group_id)
+                queue = self.queues.setdefault(group_id, [])
+                completed = self.completed_users.setdefault(group_id, [])
+                with self.tracer.span("mutation"):
+                    changed, outcome = mutation(queue, completed)
+                if not changed or await self.persist_group(group_id):
+                    break
+                logger.info(f"群聊{group_id}的队列已被其他进程修改，重新加载后重试")
+                # mutation 已作用于内存中的列表，先丢弃再从共享存储完整加载，加载失败时直接抛出
+                self.drop_group(group_id)
+                with self.tracer.span("reload_group"):
+                    self.set_group_state(group_id, *await self.run_blocking(self.shared_store.load_group, group_id))
+            snapshot = self.publish_snapshot(group_id) if changed else self.get_group_snapshot(group_id)
+            if not queue and not completed:
+                self.drop_group(group_id)
+            else:
+                self.evict_idle_groups()
+        if group_id not in self.queues and not lock.locked():
+            self.group_locks.pop(group_id, None)
+        return snapshot, outcome
+
+    async def mutate_queue_deferred(self, group_id, mutation):
+        """修改群聊队列但不等待持久化完成，返回 (snapshot, outcome, persist_task)
+
+        持久化在后台任务中持有群聊锁执行，同一群聊的写入仍按顺序完成。
+        共享状态模式下必须先提交成功才能确定修改结果，因此退化为 mutate_queue，persist_task 为 None。
+        """
+        if self.shared_store:
+            snapshot, outcome = await self.mutate_queue(group_id, mutation)
+            return snapshot, outcome, None
+        
+        lock = self.group_locks.setdefault(group_id, asyncio.Lock())
+        async with lock:
+            with self.tracer.span("refresh_group"):
+                await self.refresh_group(group_id)
+            queue = self.queues.setdefault(group_id, [])
+            completed = self.completed_users.setdefault(group_id, [])
+            with self.tracer.span("mutation"):
+                changed, outcome = mutation(queue, completed)
+            persist_task = None
+            if changed:
+                self.group_versions[group_id] = self.next_version()
+                snapshot = self.publish_snapshot(group_id)
+                # 释放锁之前登记，持久化完成前群聊不会被淘汰或移除
+                persist_task = asyncio.ensure_future(self.save_group_locked(group_id))
+                self.pending_persist[group_id] = persist_task
+            else:
+                snapshot = self.get_group_snapshot(group_id)
+            if not queue and not completed:
+                self.drop_group(group_id)
+            else:
+                self.evict_idle_groups()
+        return snapshot, outcome, persist_task
+
+    async def save_group_locked(self, group_id):
+        """持有群聊锁保存群聊数据，保证后台写入与其他修改按顺序进行
+
+        最后一个持久化任务完成后解除登记，并补上等待期间被跳过的移除和淘汰。
+        """
+        lock = self.group_locks.setdefault(group_id, asyncio.Lock())
+        async with lock:
+            try:
+                with self.tracer.span("save_group_to_storage"):
+                    await self.save_group_to_storage(group_id)
+            finally:
+                if self.pending_persist.get(group_id) is asyncio.current_task():
+                    del self.pending_persist[group_id]
+                    if not self.queues.get(group_id) and not self.completed_users.get(group_id):
+                        self.drop_group(group_id)
+                    else:
+                        self.evict_idle_groups()
+        if group_id not in self.queues and not lock.locked():
+            self.group_locks.pop(group_id, None)
+
+    def build_status_render_data(self, group_name, snapshot, limit=PREVIEW_SIZE, queue_name=None):
+        """根据快照构建队列状态图片的渲染数据，只展示前 limit 位"""
+        queue = snapshot.queue
+        return {
+            "queue_name": queue_name or self.queue_name,
+            "group_name": group_name,
+            "current_size": len(queue),
+            "max_size": self.max_queue_size,
+            "queue_items": list(snapshot.queue_items[:limit]),
+            "has_more": len(queue) > limit,
+            "more_count": len(queue) - limit if len(queue) > limit else 0,
+            "completed_users": list(snapshot.completed)
+        }
+
+    def render_snapshot(self, group_id, group_name, snapshot, view="status"):
+        """返回渲染快照状态图片的任务，同一版本的同一视图只渲染一次
+
+        view 为 "status" 时展示前 PREVIEW_SIZE 位，为 "next" 时展示即将叫号的3位。
+        并发的读取指令共享同一个渲染任务；渲染失败的任务不会保留在缓存中。
+        """
+        key = (group_id, snapshot.version, view)
+        task = self.render_cache.get(key)
+        if task is not None and not task.cancelled() and not (task.done() and task.exception()):
+            self.render_cache.move_to_end(key)
+            self.render_cache_hits += 1
+            return task
+        
+        if view == "next":
+            render_data = self.build_status_render_data(group_name, snapshot, limit=3, queue_name="即将叫号")
+        else:
+            render_data = self.build_status_render_data(group_name, snapshot)
+        task = asyncio.ensure_future(self.render_image(BEAUTIFUL_QUEUE_TEMPLATE, render_data))
+        self.cache_render(key, task)
+        return task
+
+    def cache_render(self, key, task):
+        """将渲染任务加入缓存，超过容量时淘汰最久未使用的图片"""
+        # 失败时由等待方处理异常，这里只需取出异常避免告警
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self.render_cache[key] = task
+        self.render_cache.move_to_end(key)
+        while len(self.render_cache) > max(0, self.render_cache_size):
+            self.render_cache.popitem(last=False)
+
+    def schedule_speculative_render(self, group_id, group_name):
+        """在后台预渲染“再叫一位之后”的队列状态图片
+
+        以当前版本号标记，下一次叫号时若队列未被其他操作修改，可直接发送该图片。
+        """
+        self.discard_speculative_render(group_id)
+        snapshot = self.get_group_snapshot(group_id)
+        if not snapshot.queue:
+            return
+        predicted = GroupSnapshot(None, snapshot.queue[1:], snapshot.completed + (snapshot.queue[0].user_name,))
+        render_data = self.build_status_render_data(group_name, predicted)
+        task = asyncio.ensure_future(self.render_image(BEAUTIFUL_QUEUE_TEMPLATE, render_data))
+        # 预渲染失败时不影响叫号，只需取出异常避免告警
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self.speculative_renders[group_id] = (snapshot.version, task)
+
+    def take_speculative_render(self, group_id, base_version):
+        """取出与叫号前版本号一致的预渲染任务，不一致或渲染失败时返回 None"""
+        speculation = self.speculative_renders.pop(group_id, None)
+        if speculation is None:
+            return None
+        version, task = speculation
+        if version != base_version or task.cancelled() or (task.done() and task.exception()):
+            task.cancel()
+            self.speculation_misses += 1
+            return None
+        self.speculation_hits += 1
+        logger.debug(f"群聊{group_id}使用预渲染的状态图片，累计命中 {self.speculation_hits} 次，未命中 {self.speculation_misses} 次")
+        return task
+
+    def discard_speculative_render(self, group_id):
+        """丢弃群聊的预渲染任务"""
+        speculation = self.speculative_renders.pop(group_id, None)
+        if speculation is not None:
+            speculation[1].cancel()
+
+    async def render_image(self, template, data):
+        """渲染图片，并在链路追踪中记录耗时"""
+        with self.tracer.span("html_render"):
+            return await self.html_render(template, data)
+
+    async def iter_stored_groups(self, group_ids=None):
+        """逐个读取群聊数据，产出 (group_id, queue_data, completed_data)
+
+        未加载到内存的群聊直接从存储读取，不进入内存缓存；group_ids 为空时遍历所有群聊。
+        """
+        if group_ids is None:
+            if self.shared_store:
+                group_ids = await self.run_blocking(self.shared_store.list_group_ids)
+            else:
+                group_ids = list(dict.fromkeys(list(self.queues) + list(self.persisted_groups)))
+        for group_id in group_ids:
+            if self.shared_store:
+                _, queue_data, completed_data = await self.run_blocking(self.shared_store.load_group, group_id)
+            elif group_id in self.snapshots:
+                snapshot = self.snapshots[group_id]
+                queue_data = [person.to_dict() for person in snapshot.queue]
+                completed_data = list(snapshot.completed)
+            elif group_id in self.persisted_groups:
+                group_data = await self.get_kv_data(self.group_storage_key(group_id), None) or {}
+                queue_data = group_data.get("queue", [])
+                completed_data = group_data.get("completed", [])
+            else:
+                continue
+            if queue_data or completed_data:
+                yield group_id, queue_data, completed_data
+
+    async def export_queues(self, path, group_ids=None):
+        """将群聊队列流式导出为 JSON Lines 文件，返回 (群聊数, 排队人数)
+
+        逐个群聊读取并写出，内存占用与群聊总数无关。先写入临时文件，完成后再替换目标文件。
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp_path = f"{path}.tmp"
+        group_count = 0
+        entry_count = 0
+        with open(temp_path, "w", encoding="utf-8") as f:
+            await self.run_blocking(f.write, export_header())
+            async for group_id, queue_data, completed_data in self.iter_stored_groups(group_ids):
+                await self.run_blocking(f.write, format_group_lines(group_id, queue_data, completed_data))
+                group_count += 1
+                entry_count += len(queue_data)
+        os.replace(temp_path, path)
+        logger.info(f"已导出 {group_count} 个群聊、{entry_count} 名排队用户到 {path}")
+        return group_count, entry_count
+
+    async def import_queues(self, path, target_group_id=None):
+        """从 JSON Lines 文件批量导入排队数据，返回导入统计
+
+        分块读取文件，一次遍历完成校验和去重。导出文件按群聊连续写出，因此只暂存当前群聊的数据：
+        群聊切换时立即合并并清空暂存。暂存的排队条目最多 max_queue_size 人，已完成记录每
+        IMPORT_COMPLETED_BATCH 条合并一次，内存占用不随文件行数增长（只额外记录导入过的群聊ID）。
+        记录不连续的群聊会分多次合并（合并时仍与群聊已有的数据去重），结果相同但保存次数更多。
+        target_group_id 不为空时，所有记录都导入到该群聊。
+        """
+        stats = {"groups": 0, "imported": 0, "completed": 0, "duplicates": 0, "full": 0, "invalid": 0}
+        current_group = None
+        entries, names, seen_ids, seen_names = [], [], set(), set()
+        imported_groups = set()  # 只记录群聊ID，与 persisted_groups 同量级
+        
+        async def flush():
+            if not entries and not names:
+                return
+            added, added_completed, duplicates, full = await self.merge_imported_group(current_group, entries, names)
+            stats["imported"] += added
+            stats["completed"] += added_completed
+            stats["duplicates"] += duplicates
+            stats["full"] += full
+            entries.clear()
+            names.clear()
+            seen_ids.clear()
+            seen_names.clear()
+        
+        with open(path, encoding="utf-8") as f:
+            line_number = 0
+            while True:
+                lines = await self.run_blocking(f.readlines, 64 * 1024)
+                if not lines:
+                    break
+                for line in lines:
+                    line_number += 1
+                    try:
+                        record = parse_import_line(line)
+                    except ValueError as e:
+                        stats["invalid"] += 1
+                        if stats["invalid"] <= 10:
+                            logger.warning(f"导入文件第{line_number}行无效：{e}")
+                        continue
+                    if record is None:
+                        continue
+                    
+                    group_id = target_group_id if target_group_id is not None else record["group_id"]
+                    if group_id != current_group:
+                        await flush()
+                        current_group = group_id
+                        imported_groups.add(group_id)
+                    
+                    if record["type"] == "completed":
+                        if record["user_name"] in seen_names:
+                            stats["duplicates"] += 1
+                            continue
+                        seen_names.add(record["user_name"])
+                        names.append(intern_value(record["user_name"]))
+                        if len(names) >= IMPORT_COMPLETED_BATCH:
+                            await flush()
+                        continue
+                    
+                    if record["user_id"] in seen_ids:
+                        stats["duplicates"] += 1
+                        continue
+                    if len(entries) >= self.max_queue_size:
+                        stats["full"] += 1
+                        continue
+                    # 只记录已暂存的用户，去重集合的大小同样受队列人数上限约束
+                    seen_ids.add(record["user_id"])
+                    entries.append(QueueEntry(record["user_id"], record["user_name"], 0, int(record.get("join_time") or time.time())))
+            await flush()
+        
+        stats["groups"] = len(imported_groups)
+        logger.info(f"从 {path} 导入完成：{stats}")
+        return stats
+
+    async def merge_imported_group(self, group_id, entries, names):
+        """将暂存的导入数据合并到群聊并持久化一次，返回 (新增排队, 新增已完成, 重复, 超出上限)"""
+        def merge(queue, completed):
+            # 与队列中已有的用户去重，并遵守队列人数上限
+            queued_ids = {person.user_id for person in queue}
+            completed_names = set(completed)
+            added = added_completed = duplicates = full = 0
+            for entry in entries:
+                if entry.user_id in queued_ids:
+                    duplicates += 1
+                    continue
+                if len(queue) >= self.max_queue_size:
+                    full += 1
+                    continue
+                queue.append(entry.with_position(len(queue) + 1))
+                queued_ids.add(entry.user_id)
+                added += 1
+            for user_name in names:
+                if user_name in completed_names:
+                    duplicates += 1
+                    continue
+                completed.append(user_name)
+                completed_names.add(user_name)
+                added_completed += 1
+            return bool(added or added_completed), (added, added_completed, duplicates, full)
+        
+        _, counts = await self.mutate_queue(group_id, merge)
+        return counts
+
+    def renumber_queue(self, queue, start):
+        """从 start 处开始重新编号，之前的条目位置不变
+
+        条目可能仍被已发布的快照引用，因此替换为新条目而不是原地修改。
+        """
+        with self.tracer.span("renumber_queue", count=len(queue) - start):
+            for i in range(start, len(queue)):
+                queue[i] = queue[i].with_position(i + 1)
+
     def __del__(self):
         """插件销毁时停止定时任务"""
         if hasattr(self, 'clear_task') and self.clear_task:
@@ -396,15 +1050,158 @@ class QueuePlugin(Star):
         except:
             return "private"
 
-    def get_queue(self, event: AstrMessageEvent):
-        """获取当前群聊的队列"""
+    def get_message_id(self, event: AstrMessageEvent):
+        """获取消息ID，平台不提供时返回 None"""
+        try:
+            return getattr(getattr(event, 'message_obj', None), 'message_id', None)
+        except:
+            return None
+
+    def get_dedup_keys(self, event: AstrMessageEvent, command, arguments=()):
+        """生成去重键及其有效期
+
+        消息ID用于识别适配器的重复投递；发送者+指令+参数+时间窗口用于识别管理员连点。
+        """
+        group_id = self.get_group_id(event)
+        keys = []
+        message_id = self.get_message_id(event)
+        if message_id:
+            keys.append((("msg", group_id, message_id), self.dedup_ttl_seconds))
+        if self.dedup_window_seconds > 0:
+            keys.append((("cmd", group_id, event.get_sender_id(), command, arguments), self.dedup_window_seconds))
+        return keys
+
+    def mark_duplicate(self, event: AstrMessageEvent):
+        """在事件上标记该指令被判定为重复，供流量录制使用"""
+        try:
+            event.set_extra("queue_duplicate", True)
+        except:
+            pass
+
+    def record_traffic(self, event: AstrMessageEvent, command, started):
+        """录制一条指令及其执行后的队列状态"""
+        try:
+            user_id = event.get_sender_id()
+            group_id = self.get_group_id(event)
+            try:
+                duplicate = bool(event.get_extra("queue_duplicate"))
+            except:
+                duplicate = False
+            snapshot = self.get_group_snapshot(group_id)
+            self.recorder.record(
+                started,
+                group_id,
+                user_id,
+                event.get_sender_name(),
+                command,
+                message_id=self.get_message_id(event),
+                duplicate=duplicate,
+                can_call=str(user_id) in self.call_permission_users,
+                is_admin=str(user_id) in self.admin_users,
+                queue=snapshot.queue,
+                completed=snapshot.completed,
+            )
+        except Exception as e:
+            logger.error(f"录制指令流量时出错：{e}")
+
+    async def run_idempotent(self, event: AstrMessageEvent, command, results, arguments=()):
+        """执行指令并缓存其回复，命中去重缓存时重放首次执行的回复"""
+        if not self.enable_dedup:
+            async for result in results:
+                yield result
+            return
+        
+        keys = self.get_dedup_keys(event, command, arguments)
+        while True:
+            cached = None
+            for key, _ in keys:
+                cached = self.dedup_cache.get(key)
+                if cached is not None:
+                    break
+            if cached is None:
+                break
+            # 首次执行可能仍在进行中，等待其完成后重放回复
+            await cached.done.wait()
+            if cached.failed:
+                # 首次执行失败，回复不完整，重新检查后自行执行
+                continue
+            await results.aclose()
+            self.mark_duplicate(event)
+            self.dedup_cache.suppressed += 1
+            logger.info(f"已拦截重复指令 /{command}，累计拦截 {self.dedup_cache.suppressed} 次")
+            for result in cached.results:
+                yield result
+            return
+        
+        entries = [(key, self.dedup_cache.put(key, ttl)) for key, ttl in keys]
+        try:
+            async for result in results:
+                for _, entry in entries:
+                    entry.results.append(result)
+                yield result
+        except BaseException:
+            # 执行失败时不缓存，允许重试
+            for key, entry in entries:
+                self.dedup_cache.discard(key, entry)
+            raise
+        finally:
+            for _, entry in entries:
+                entry.done.set()
+
+    async def get_snapshot(self, event: AstrMessageEvent):
+        """获取当前群聊最新发布的快照，返回 (snapshot, group_id)
+
+        不获取群聊锁，不会等待正在进行的修改；群聊没有数据时返回空快照且不创建状态。
+        """
         group_id = self.get_group_id(event)
-        if group_id not in self.queues:
-            self.queues[group_id] = []
-        if group_id not in self.completed_users:
-            self.completed_users[group_id] = []
-        return self.queues[group_id], group_id
+        with self.tracer.span("get_snapshot"):
+            await self.refresh_group(group_id)
+        return self.get_group_snapshot(group_id), group_id
     
+    def parse_notify_positions(self, positions):
+        """解析提醒位置配置，返回去重后升序排列的正整数列表"""
+        parsed = set()
+        for value in positions or []:
+            try:
+                position = int(value)
+            except (TypeError, ValueError):
+                logger.warning(f"忽略无效的提醒位置配置：{value}")
+                continue
+            if position > 0:
+                parsed.add(position)
+        return sorted(parsed)
+
+    def build_position_notify_chain(self, queue, removed_index):
+        """构建位置提醒消息链
+
+        队列在 removed_index 处移除一人后，只有该位置之后的条目前移一位，
+        因此只需检查各提醒位置上的条目，无需扫描整个队列。
+        同一次事件的所有提醒合并为一条消息链，没有需要提醒的用户时返回 None。
+        """
+        if not self.enable_position_notify:
+            return None
+        
+        chain = []
+        for position in self.notify_positions:
+            index = position - 1
+            if index >= len(queue):
+                break
+            # 位于移除点之前的条目位置未变化，不重复提醒
+            if index < removed_index:
+                continue
+            person = queue[index]
+            if position == 1:
+                text = self.next_notify_message
+            else:
+                text = self.position_notify_message.format(position=position)
+            chain.append(Comp.At(qq=person.user_id))
+            chain.append(Comp.Plain(f" {text}\n"))
+        
+        if not chain:
+            return None
+        chain.insert(0, Comp.Plain("📢 排队提醒\n"))
+        return chain
+
     def start_auto_clear_task(self):
         """启动定时清除任务"""
         if self.clear_task:
@@ -457,13 +1254,17 @@ class QueuePlugin(Star):
     async def clear_all_queues_task(self):
         """定时任务：清空所有队列"""
         try:
-            total_queues = len(self.queues)
+            total_queues = len(set(self.queues) | self.persisted_groups)
             self.queues.clear()
             self.completed_users.clear()
+            self.snapshots.clear()
             
             # 同时清除持久化存储的数据
             await self.clear_storage_data()
             
+            if self.recorder.enabled:
+                self.recorder.record(time.time(), "*", "system", "system", "定时清空")
+            
             # 记录日志
             logger.info(f"定时清除完成：清空了 {total_queues} 个群聊的队列和已完成记录，并清除了持久化存储")
             
@@ -474,158 +1275,149 @@ class QueuePlugin(Star):
             logger.error(f"定时清除队列时出错：{e}")
 
     @filter.command("排队")
+    @instrumented("排队")
+    @idempotent("排队")
     async def join_queue(self, event: AstrMessageEvent):
         """加入排队"""
         user_id = event.get_sender_id()
         user_name = event.get_sender_name()
-        queue, group_id = self.get_queue(event)
+        group_id = self.get_group_id(event)
         group_name = f"群聊{group_id}" if group_id != "private" else "私聊"
         
-        # 检查是否已经在队列中
-        for person in queue:
-            if person["user_id"] == user_id:
-                yield event.plain_result(f"❌ 你已经在队列中了，位置：第{person['position']}位")
-                return
-        
-        # 检查是否已经完成过排队（如果配置不允许重复排队）
-        if not self.allow_requeue:
-            completed_users_list = self.completed_users.get(group_id, [])
-            if user_name in completed_users_list:
-                yield event.plain_result(f"❌ 你今天已经排过队并完成了，不能再次排队！")
-                return
+        def join(queue, completed):
+            # 检查是否已经在队列中
+            for person in queue:
+                if person.user_id == user_id:
+                    return False, ("queued", person.position)
+            
+            # 检查是否已经完成过排队（如果配置不允许重复排队）
+            if not self.allow_requeue and user_name in completed:
+                return False, ("completed", None)
+            
+            # 检查队列是否已满
+            if len(queue) >= self.max_queue_size:
+                return False, ("full", None)
+            
+            # 加入队列
+            position = len(queue) + 1
+            queue.append(QueueEntry(user_id, user_name, position, int(time.time())))
+            return True, ("joined", position)
         
-        # 检查队列是否已满
-        if len(queue) >= self.max_queue_size:
+        # 加入队列并保存数据到持久化存储
+        snapshot, (status, position) = await self.mutate_queue(group_id, join)
+        queue = snapshot.queue
+        if status == "queued":
+            yield event.plain_result(f"❌ 你已经在队列中了，位置：第{position}位")
+            return
+        if status == "completed":
+            yield event.plain_result(f"❌ 你今天已经排过队并完成了，不能再次排队！")
+            return
+        if status == "full":
             yield event.plain_result(f"❌ 队列已满！当前队列人数：{len(queue)}/{self.max_queue_size}")
             return
         
-        # 加入队列
-        position = len(queue) + 1
-        queue.append({
-            "user_id": user_id,
-            "user_name": user_name,
-            "position": position,
-            "join_time": int(time.time())
-        })
-        
-        # 保存数据到持久化存储
-        await self.save_queues_to_storage()
-        
         # 发送排队成功消息
         yield event.plain_result(f"✅ 排队成功！\n📍 你的位置：第{position}位\n👥 当前{group_name}队列人数：{len(queue)}")
         
         # 发送当前队列状态
         if queue:
-            # 准备渲染数据
-            render_data = {
-                "queue_name": self.queue_name,
-                "group_name": group_name,
-                "current_size": len(queue),
-                "max_size": self.max_queue_size,
-                "queue_items": queue[:10],  # 只显示前10人
-                "has_more": len(queue) > 10,
-                "more_count": len(queue) - 10 if len(queue) > 10 else 0,
-                "completed_users": self.completed_users.get(group_id, [])
-            }
-            # 使用自定义暖色调模板
+            # 使用自定义暖色调模板，只显示前10人
             try:
-                image_url = await self.html_render(BEAUTIFUL_QUEUE_TEMPLATE, render_data)
+                image_url = await asyncio.shield(self.render_snapshot(group_id, group_name, snapshot))
                 yield event.image_result(image_url)
             except Exception as e:
                 logger.error(f"发送队列状态图片失败：{e}")
                 # 回退到文字版本
-                queue_info = f"📋 {group_name}{self.queue_name}状态\n" + f"👥 队列人数：{len(queue)}/{self.max_queue_size}\n\n"
-                for i, person in enumerate(queue[:10], 1):
-                    queue_info += f"{i}. {person['user_name']}\n"
-                if len(queue) > 10:
-                    queue_info += f"... 还有{len(queue) - 10}人"
+                with self.tracer.span("text_fallback"):
+                    queue_info = f"📋 {group_name}{self.queue_name}状态\n" + f"👥 队列人数：{len(queue)}/{self.max_queue_size}\n\n"
+                    for i, person in enumerate(queue[:10], 1):
+                        queue_info += f"{i}. {person.user_name}\n"
+                    if len(queue) > 10:
+                        queue_info += f"... 还有{len(queue) - 10}人"
                 yield event.plain_result(queue_info)
 
     @filter.command("退出排队")
+    @instrumented("退出排队")
+    @idempotent("退出排队")
     async def leave_queue(self, event: AstrMessageEvent):
         """退出排队"""
         user_id = event.get_sender_id()
-        queue, group_id = self.get_queue(event)
+        group_id = self.get_group_id(event)
         
-        # 查找用户在队列中的位置
-        found_index = -1
-        for i, person in enumerate(queue):
-            if person["user_id"] == user_id:
-                found_index = i
-                break
+        def leave(queue, completed):
+            # 查找用户在队列中的位置
+            for i, person in enumerate(queue):
+                if person.user_id == user_id:
+                    # 从队列中移除，并重新排序其后人员的位置
+                    removed_person = queue.pop(i)
+                    self.renumber_queue(queue, i)
+                    return True, (i, removed_person)
+            return False, (-1, None)
         
+        # 退出队列并保存数据到持久化存储
+        snapshot, (found_index, removed_person) = await self.mutate_queue(group_id, leave)
+        queue = snapshot.queue
         if found_index == -1:
             yield event.plain_result("❌ 你不在队列中")
             return
         
-        # 从队列中移除
-        removed_person = queue.pop(found_index)
-        
-        # 重新排序剩余人员的位置
-        for i, person in enumerate(queue):
-            person["position"] = i + 1
-        
-        # 保存数据到持久化存储
-        await self.save_queues_to_storage()
-        
         group_name = f"群聊{group_id}" if group_id != "private" else "私聊"
-        yield event.plain_result(f"✅ 已退出排队\n👤 {removed_person['user_name']} (原位置：第{removed_person['position']}位)\n👥 {group_name}剩余队列人数：{len(queue)}")
+        yield event.plain_result(f"✅ 已退出排队\n👤 {removed_person.user_name} (原位置：第{removed_person.position}位)\n👥 {group_name}剩余队列人数：{len(queue)}")
+        
+        # 通知因前移而到达提醒位置的用户
+        notify_chain = self.build_position_notify_chain(queue, found_index)
+        if notify_chain:
+            yield event.chain_result(notify_chain)
 
     @filter.command("查看队列")
+    @instrumented("查看队列")
     async def view_queue(self, event: AstrMessageEvent):
         """查看当前队列状态"""
-        queue, group_id = self.get_queue(event)
+        snapshot, group_id = await self.get_snapshot(event)
+        queue = snapshot.queue
         group_name = f"群聊{group_id}" if group_id != "private" else "私聊"
         
         if not queue:
             yield event.plain_result(f"📋 {group_name}队列为空，暂无排队人员")
             return
         
-        # 准备渲染数据
-        render_data = {
-            "queue_name": self.queue_name,
-            "group_name": group_name,
-            "current_size": len(queue),
-            "max_size": self.max_queue_size,
-            "queue_items": queue[:10],  # 只显示前10人
-            "has_more": len(queue) > 10,
-            "more_count": len(queue) - 10 if len(queue) > 10 else 0,
-            "completed_users": self.completed_users.get(group_id, [])
-        }
-        
-        # 使用自定义暖色调模板
+        # 使用自定义暖色调模板，只显示前10人；队列未变化时直接使用缓存的图片
         try:
-            image_url = await self.html_render(BEAUTIFUL_QUEUE_TEMPLATE, render_data)
+            image_url = await asyncio.shield(self.render_snapshot(group_id, group_name, snapshot))
             yield event.image_result(image_url)
         except Exception as e:
             logger.error(f"发送队列状态图片失败：{e}")
             # 回退到文字版本
-            queue_info = f"📋 {group_name}{self.queue_name}状态\n"
-            queue_info += f"👥 队列人数：{len(queue)}/{self.max_queue_size}\n\n"
-            for i, person in enumerate(queue[:10], 1):
-                queue_info += f"{i}. {person['user_name']}\n"
-            if len(queue) > 10:
-                queue_info += f"... 还有{len(queue) - 10}人"
+            with self.tracer.span("text_fallback"):
+                queue_info = f"📋 {group_name}{self.queue_name}状态\n"
+                queue_info += f"👥 队列人数：{len(queue)}/{self.max_queue_size}\n\n"
+                for i, person in enumerate(queue[:10], 1):
+                    queue_info += f"{i}. {person.user_name}\n"
+                if len(queue) > 10:
+                    queue_info += f"... 还有{len(queue) - 10}人"
             yield event.plain_result(queue_info)
 
     @filter.command("我的位置")
+    @instrumented("我的位置")
     async def my_position(self, event: AstrMessageEvent):
         """查看自己在队列中的位置"""
         user_id = event.get_sender_id()
-        queue, group_id = self.get_queue(event)
+        snapshot, group_id = await self.get_snapshot(event)
         group_name = f"群聊{group_id}" if group_id != "private" else "私聊"
         
-        for person in queue:
-            if person["user_id"] == user_id:
-                yield event.plain_result(f"📍 你在{group_name}队列中的位置：第{person['position']}位\n👥 当前{group_name}队列总人数：{len(queue)}")
-                return
+        person = snapshot.find(user_id)
+        if person is not None:
+            yield event.plain_result(f"📍 你在{group_name}队列中的位置：第{person.position}位\n👥 当前{group_name}队列总人数：{len(snapshot.queue)}")
+            return
         
         yield event.plain_result(f"❌ 你不在{group_name}队列中")
 
     @filter.command("清空队列")
+    @instrumented("清空队列")
+    @idempotent("清空队列")
     async def clear_queue(self, event: AstrMessageEvent):
         """清空当前群聊队列（管理员功能）"""
-        queue, group_id = self.get_queue(event)
+        group_id = self.get_group_id(event)
         group_name = f"群聊{group_id}" if group_id != "private" else "私聊"
         
         # 权限检查
@@ -635,15 +1427,19 @@ class QueuePlugin(Star):
                 yield event.plain_result("❌ 你没有使用'清空队列'指令的权限")
                 return
         
-        queue.clear()
-        self.completed_users[group_id] = []
+        def clear(queue, completed):
+            queue.clear()
+            completed.clear()
+            return True, None
         
-        # 保存数据到持久化存储
-        await self.save_queues_to_storage()
+        # 清空并保存数据到持久化存储
+        await self.mutate_queue(group_id, clear)
         
         yield event.plain_result(f"🗑️ {group_name}队列和已完成记录已清空")
 
     @filter.command("清空所有队列")
+    @instrumented("清空所有队列")
+    @idempotent("清空所有队列")
     async def clear_all_queues(self, event: AstrMessageEvent):
         """清空所有群聊队列（高级管理员功能）"""
         user_id = event.get_sender_id()
@@ -653,22 +1449,25 @@ class QueuePlugin(Star):
             yield event.plain_result("❌ 你没有使用'清空所有队列'指令的权限，需要高级管理员权限")
             return
         
-        total_cleared = len(self.queues)
+        total_cleared = len(set(self.queues) | self.persisted_groups)
         self.queues.clear()
         self.completed_users.clear()
+        self.snapshots.clear()
         
-        # 保存数据到持久化存储
-        await self.save_queues_to_storage()
+        # 同时清除持久化存储的数据
+        await self.clear_storage_data()
         
         yield event.plain_result(f"🗑️ 已清空所有{total_cleared}个群聊的队列和已完成记录")
 
     @filter.command("下一位")
+    @instrumented("下一位")
+    @idempotent("下一位")
     async def call_next(self, event: AstrMessageEvent):
         """叫号系统：呼叫下一位"""
-        queue, group_id = self.get_queue(event)
+        snapshot, group_id = await self.get_snapshot(event)
         group_name = f"群聊{group_id}" if group_id != "private" else "私聊"
         
-        if not queue:
+        if not snapshot.queue:
             yield event.plain_result(f"📋 {group_name}队列为空，暂无呼叫对象")
             return
         
@@ -679,116 +1478,134 @@ class QueuePlugin(Star):
                 yield event.plain_result("❌ 你没有使用'下一位'指令的权限")
                 return
         
-        # 取出第一位用户
-        next_person = queue.pop(0)
-        
-        # 添加到已完成用户列表
-        if group_id not in self.completed_users:
-            self.completed_users[group_id] = []
-        self.completed_users[group_id].append(next_person['user_name'])
+        def call(queue, completed):
+            if not queue:
+                return False, (None, None)
+            # 叫号前的版本号，用于匹配预渲染的状态图片
+            base_version = self.group_versions.get(group_id, 0)
+            # 取出第一位用户，添加到已完成用户列表
+            next_person = queue.pop(0)
+            completed.append(intern_value(next_person.user_name))
+            # 重新排序剩余人员的位置
+            self.renumber_queue(queue, 0)
+            return True, (next_person, base_version)
         
-        # 保存数据到持久化存储
-        await self.save_queues_to_storage()
-        
-        # 重新排序剩余人员的位置
-        for i, person in enumerate(queue):
-            person["position"] = i + 1
+        if self.enable_pipelined_call:
+            # 流水线模式：持久化在后台进行，不阻塞叫号通知
+            snapshot, (next_person, base_version), persist_task = await self.mutate_queue_deferred(group_id, call)
+        else:
+            # 叫号并保存数据到持久化存储
+            snapshot, (next_person, base_version) = await self.mutate_queue(group_id, call)
+            persist_task = None
+        queue = snapshot.queue
+        if next_person is None:
+            # 其他进程已先一步叫走了最后一位
+            yield event.plain_result(f"📋 {group_name}队列为空，暂无呼叫对象")
+            return
         
         # 发送叫号消息，包含@功能
-        # 使用配置的叫号消息，替换用户名占位符
-        formatted_message = self.call_message.format(user_name=next_person['user_name'])
+        with self.tracer.span("build_at_chain"):
+            # 使用配置的叫号消息，替换用户名占位符
+            formatted_message = self.call_message.format(user_name=next_person.user_name)
+            
+            call_chain = [
+                Comp.At(qq=next_person.user_id),  # @被叫用户
+                Comp.Plain(f" {formatted_message}")
+            ]
         
-        call_chain = [
-            Comp.At(qq=next_person['user_id']),  # @被叫用户
-            Comp.Plain(f" {formatted_message}")
-        ]
+        # 显示完整队列状态
+        if self.enable_pipelined_call:
+            # 优先使用上一次叫号后预渲染的图片，否则立即开始渲染，与发送@消息并行
+            render_task = self.take_speculative_render(group_id, base_version)
+            if render_task is not None:
+                self.cache_render((group_id, snapshot.version, "status"), render_task)
+            else:
+                render_task = self.render_snapshot(group_id, group_name, snapshot)
+        else:
+            render_task = None
         
         try:
             yield event.chain_result(call_chain)
         except:
             # 如果不支持@功能，发送简化版本
-            call_message = f"{next_person['user_name']} {formatted_message}"
+            call_message = f"{next_person.user_name} {formatted_message}"
             yield event.plain_result(call_message)
         
-        # 显示完整队列状态
-        render_data = {
-            "queue_name": self.queue_name,
-            "group_name": group_name,
-            "current_size": len(queue),
-            "max_size": self.max_queue_size,
-            "queue_items": queue[:10],
-            "has_more": len(queue) > 10,
-            "more_count": len(queue) - 10 if len(queue) > 10 else 0,
-            "completed_users": self.completed_users.get(group_id, [])
-        }
+        # 通知因前移而到达提醒位置的用户
+        notify_chain = self.build_position_notify_chain(queue, 0)
+        if notify_chain:
+            yield event.chain_result(notify_chain)
         
         try:
-            image_url = await self.html_render(BEAUTIFUL_QUEUE_TEMPLATE, render_data)
+            if render_task is None:
+                render_task = self.render_snapshot(group_id, group_name, snapshot)
+            image_url = await asyncio.shield(render_task)
             yield event.image_result(image_url)
         except Exception as e:
             logger.error(f"发送叫号状态图片失败：{e}")
             # 回退到文字版本
-            queue_info = f"\n📋 {self.queue_status_title}：\n\n"
-            if self.completed_users[group_id]:
-                queue_info += f"✅ {self.completed_label}：\n"
-                for completed_user in self.completed_users[group_id]:
-                    queue_info += f"• {completed_user} ({self.completed_label})\n"
-                queue_info += "\n"
-            if queue:
-                queue_info += f"⏳ {self.waiting_label}：\n"
-                for i, person in enumerate(queue, 1):
-                    queue_info += f"{i}. {person['user_name']}\n"
-            else:
-                queue_info += f"⏳ {self.waiting_label}：\n暂无排队人员"
+            with self.tracer.span("text_fallback"):
+                queue_info = f"\n📋 {self.queue_status_title}：\n\n"
+                completed = snapshot.completed
+                if completed:
+                    queue_info += f"✅ {self.completed_label}：\n"
+                    for completed_user in completed:
+                        queue_info += f"• {completed_user} ({self.completed_label})\n"
+                    queue_info += "\n"
+                if queue:
+                    queue_info += f"⏳ {self.waiting_label}：\n"
+                    for i, person in enumerate(queue, 1):
+                        queue_info += f"{i}. {person.user_name}\n"
+                else:
+                    queue_info += f"⏳ {self.waiting_label}：\n暂无排队人员"
             yield event.plain_result(queue_info)
+        
+        if persist_task is not None:
+            await persist_task
+        if self.enable_pipelined_call:
+            self.schedule_speculative_render(group_id, group_name)
 
     @filter.command("当前叫号")
+    @instrumented("当前叫号")
     async def current_calling(self, event: AstrMessageEvent):
         """查看当前正在叫号的状态"""
-        queue, group_id = self.get_queue(event)
+        snapshot, group_id = await self.get_snapshot(event)
+        queue = snapshot.queue
         group_name = f"群聊{group_id}" if group_id != "private" else "私聊"
         
         if not queue:
             yield event.plain_result(f"📋 {group_name}队列为空，暂无排队人员")
             return
         
-        # 准备渲染数据
-        render_data = {
-            "queue_name": "即将叫号",
-            "group_name": group_name,
-            "current_size": len(queue),
-            "max_size": self.max_queue_size,
-            "queue_items": queue[:3],  # 显示即将叫的3人
-            "has_more": len(queue) > 3,
-            "more_count": len(queue) - 3 if len(queue) > 3 else 0,
-            "completed_users": self.completed_users.get(group_id, [])
-        }
-        
+        # 显示即将叫的3人
         try:
-            image_url = await self.html_render(BEAUTIFUL_QUEUE_TEMPLATE, render_data)
+            image_url = await asyncio.shield(self.render_snapshot(group_id, group_name, snapshot, view="next"))
             yield event.image_result(image_url)
         except Exception as e:
             logger.error(f"发送当前叫号图片失败：{e}")
             # 回退到文字版本
-            preview_message = f"📋 {group_name}即将叫号\n\n"
-            next_count = min(3, len(queue))
-            for i in range(next_count):
-                person = queue[i]
-                if i == 0:
-                    preview_message += f"🔔 下一位：{person['user_name']}\n"
-                else:
-                    preview_message += f"{i+1}. {person['user_name']}\n"
-            if len(queue) > 3:
-                preview_message += f"... 还有{len(queue) - 3}人等待"
+            with self.tracer.span("text_fallback"):
+                preview_message = f"📋 {group_name}即将叫号\n\n"
+                next_count = min(3, len(queue))
+                for i in range(next_count):
+                    person = queue[i]
+                    if i == 0:
+                        preview_message += f"🔔 下一位：{person.user_name}\n"
+                    else:
+                        preview_message += f"{i+1}. {person.user_name}\n"
+                if len(queue) > 3:
+                    preview_message += f"... 还有{len(queue) - 3}人等待"
             yield event.plain_result(preview_message)
 
     @filter.command("跳过")
+    @instrumented("跳过")
+    @idempotent("跳过")
     async def skip_current(self, event: AstrMessageEvent):
         """跳过当前第一位（管理员功能）"""
-        queue, group_id = self.get_queue(event)
+        snapshot, group_id = await self.get_snapshot(event)
         group_name = f"群聊{group_id}" if group_id != "private" else "私聊"
         
-        if not queue:
+        if not snapshot.queue:
             yield event.plain_result(f"📋 {group_name}队列为空，无法跳过")
             return
         
@@ -799,19 +1616,94 @@ class QueuePlugin(Star):
                 yield event.plain_result("❌ 你没有使用'跳过'指令的权限")
                 return
         
-        # 跳过第一位
-        skipped_person = queue.pop(0)
+        def skip(queue, completed):
+            if not queue:
+                return False, None
+            # 跳过第一位并重新排序
+            skipped_person = queue.pop(0)
+            self.renumber_queue(queue, 0)
+            return True, skipped_person
+        
+        # 跳过并保存数据到持久化存储
+        snapshot, skipped_person = await self.mutate_queue(group_id, skip)
+        queue = snapshot.queue
+        if skipped_person is None:
+            yield event.plain_result(f"📋 {group_name}队列为空，无法跳过")
+            return
+        
+        yield event.plain_result(f"⏭️ 已跳过 {skipped_person.user_name}\n👥 剩余{len(queue)}人等待")
+        
+        # 通知因前移而到达提醒位置的用户
+        notify_chain = self.build_position_notify_chain(queue, 0)
+        if notify_chain:
+            yield event.chain_result(notify_chain)
+
+    @filter.command("导出队列")
+    @instrumented("导出队列")
+    async def export_queue_command(self, event: AstrMessageEvent, scope: str = ""):
+        """导出当前群聊或所有群聊的队列（高级管理员功能）"""
+        user_id = event.get_sender_id()
+        if str(user_id) not in self.admin_users:
+            yield event.plain_result("❌ 你没有使用'导出队列'指令的权限，需要高级管理员权限")
+            return
         
-        # 重新排序
-        for i, person in enumerate(queue):
-            person["position"] = i + 1
+        group_id = self.get_group_id(event)
+        export_all = scope == "全部"
+        target = "all" if export_all else re.sub(r"[^\w-]", "_", str(group_id))
+        file_name = f"queue_export_{target}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+        path = os.path.join(self.export_dir, file_name)
         
-        # 保存数据到持久化存储
-        await self.save_queues_to_storage()
+        try:
+            group_count, entry_count = await self.export_queues(path, None if export_all else [group_id])
+        except Exception as e:
+            logger.error(f"导出队列时出错：{e}")
+            yield event.plain_result(f"❌ 导出失败：{e}")
+            return
+        
+        yield event.plain_result(f"📤 已导出{group_count}个群聊、{entry_count}名排队用户\n📄 文件：{file_name}")
+
+    @filter.command("导入队列")
+    @instrumented("导入队列")
+    @idempotent("导入队列")
+    async def import_queue_command(self, event: AstrMessageEvent, file_name: str = "", scope: str = ""):
+        """从导出目录批量导入队列（高级管理员功能）"""
+        user_id = event.get_sender_id()
+        if str(user_id) not in self.admin_users:
+            yield event.plain_result("❌ 你没有使用'导入队列'指令的权限，需要高级管理员权限")
+            return
+        
+        if not file_name:
+            yield event.plain_result("❌ 请指定导入文件名，例如：/导入队列 queue_export_all_20250101_120000.jsonl [全部]")
+            return
+        
+        # 只允许读取导出目录中的文件
+        path = os.path.join(self.export_dir, os.path.basename(file_name))
+        if not os.path.isfile(path):
+            yield event.plain_result(f"❌ 找不到导入文件：{os.path.basename(file_name)}")
+            return
+        
+        # 默认导入到当前群聊，指定“全部”时按文件中记录的群聊导入
+        target_group_id = None if scope == "全部" else self.get_group_id(event)
+        try:
+            stats = await self.import_queues(path, target_group_id)
+        except Exception as e:
+            logger.error(f"导入队列时出错：{e}")
+            yield event.plain_result(f"❌ 导入失败：{e}")
+            return
         
-        yield event.plain_result(f"⏭️ 已跳过 {skipped_person['user_name']}\n👥 剩余{len(queue)}人等待")
+        result = f"📥 导入完成：{stats['groups']}个群聊\n"
+        result += f"✅ 新增排队：{stats['imported']}人\n"
+        result += f"✅ 新增已完成记录：{stats['completed']}条\n"
+        if stats["duplicates"]:
+            result += f"⚠️ 重复跳过：{stats['duplicates']}条\n"
+        if stats["full"]:
+            result += f"⚠️ 超出队列上限跳过：{stats['full']}人\n"
+        if stats["invalid"]:
+            result += f"❌ 格式错误：{stats['invalid']}行\n"
+        yield event.plain_result(result.rstrip())
 
     @filter.command("排队帮助", alias={'help', '帮助'})
+    @instrumented("排队帮助")
     async def queue_help(self, event: AstrMessageEvent):
         """显示排队系统帮助信息"""
         permission_text = " (需要权限)" if self.enable_call_permission else ""
@@ -827,8 +1719,12 @@ class QueuePlugin(Star):
             config_items.append({"key": "清空时间", "value": self.clear_time})
         if self.enable_call_permission:
             config_items.append({"key": "叫号权限", "value": "已启用"})
+        if self.enable_position_notify:
+            config_items.append({"key": "位置提醒", "value": "、".join(f"第{p}位" for p in self.notify_positions)})
         if self.admin_users:
             config_items.append({"key": "高级管理员", "value": f"{len(self.admin_users)}名"})
+        if self.enable_dedup:
+            config_items.append({"key": "重复指令拦截", "value": f"已拦截{self.dedup_cache.suppressed}次"})
         
         # 准备渲染数据
         help_data = {
@@ -839,44 +1735,52 @@ class QueuePlugin(Star):
         
         try:
             # 使用自定义暖色调帮助模板
-            image_url = await self.html_render(HELP_TEMPLATE, help_data)
+            image_url = await self.render_image(HELP_TEMPLATE, help_data)
             yield event.image_result(image_url)
         except Exception as e:
             logger.error(f"发送帮助信息图片失败：{e}")
             # 回退到文字版本
-            help_text = f"📋 {self.queue_name}系统使用帮助\n\n"
-            help_text += "👤 用户指令：\n"
-            help_text += "• /排队 - 加入排队队列\n"
-            help_text += "• /退出排队 - 退出当前排队\n"
-            help_text += "• /查看队列 - 查看当前队列状态\n"
-            help_text += "• /我的位置 - 查看自己在队列中的位置\n"
-            help_text += "• /当前叫号 - 查看即将被叫的用户\n"
-            help_text += "• /排队帮助 - 显示此帮助信息\n\n"
-            help_text += "🔧 管理员指令：\n"
-            help_text += f"• /下一位 - 呼叫队列中的下一位用户{permission_text}\n"
-            help_text += f"• /跳过 - 跳过队列中的第一位用户{permission_text}\n"
-            help_text += f"• /清空队列 - 清空当前群聊的队列和已完成记录{permission_text}\n"
-            help_text += "• /清空所有队列 - 清空所有群聊的队列和已完成记录 (需要高级管理员权限)\n\n"
-            help_text += f"⚙️ 当前配置：\n"
-            help_text += f"• 队列名称：{self.queue_name}\n"
-            help_text += f"• 最大队列人数：{self.max_queue_size}\n"
-            help_text += f"• 重复排队：{'允许' if self.allow_requeue else '不允许'}\n"
-            help_text += f"• 自动清空：{'启用' if self.enable_auto_clear else '未启用'}"
-            if self.enable_auto_clear:
-                help_text += f" (每天 {self.clear_time})"
-            help_text += "\n"
-            if self.enable_call_permission:
-                help_text += "• 叫号权限：已启用\n"
-            if self.admin_users:
-                help_text += f"• 高级管理员：{len(self.admin_users)}名\n"
-            help_text += "\n💡 提示：\n"
-            help_text += "• 每人每天只能排队一次（除非配置允许重复排队）\n"
-            help_text += "• 被叫号后会自动加入已完成列表\n"
-            help_text += "• 每天定时清空队列和已完成记录\n"
-            help_text += "• 退出排队后可以重新排队"
+            with self.tracer.span("text_fallback"):
+                help_text = f"📋 {self.queue_name}系统使用帮助\n\n"
+                help_text += "👤 用户指令：\n"
+                help_text += "• /排队 - 加入排队队列\n"
+                help_text += "• /退出排队 - 退出当前排队\n"
+                help_text += "• /查看队列 - 查看当前队列状态\n"
+                help_text += "• /我的位置 - 查看自己在队列中的位置\n"
+                help_text += "• /当前叫号 - 查看即将被叫的用户\n"
+                help_text += "• /排队帮助 - 显示此帮助信息\n\n"
+                help_text += "🔧 管理员指令：\n"
+                help_text += f"• /下一位 - 呼叫队列中的下一位用户{permission_text}\n"
+                help_text += f"• /跳过 - 跳过队列中的第一位用户{permission_text}\n"
+                help_text += f"• /清空队列 - 清空当前群聊的队列和已完成记录{permission_text}\n"
+                help_text += "• /清空所有队列 - 清空所有群聊的队列和已完成记录 (需要高级管理员权限)\n"
+                help_text += "• /导出队列 [全部] - 导出当前群聊（或所有群聊）的队列 (需要高级管理员权限)\n"
+                help_text += "• /导入队列 文件名 [全部] - 从导出目录批量导入队列 (需要高级管理员权限)\n\n"
+                help_text += f"⚙️ 当前配置：\n"
+                help_text += f"• 队列名称：{self.queue_name}\n"
+                help_text += f"• 最大队列人数：{self.max_queue_size}\n"
+                help_text += f"• 重复排队：{'允许' if self.allow_requeue else '不允许'}\n"
+                help_text += f"• 自动清空：{'启用' if self.enable_auto_clear else '未启用'}"
+                if self.enable_auto_clear:
+                    help_text += f" (每天 {self.clear_time})"
+                help_text += "\n"
+                if self.enable_call_permission:
+                    help_text += "• 叫号权限：已启用\n"
+                if self.enable_position_notify:
+                    help_text += f"• 位置提醒：{'、'.join(f'第{p}位' for p in self.notify_positions)}\n"
+                if self.admin_users:
+                    help_text += f"• 高级管理员：{len(self.admin_users)}名\n"
+                if self.enable_dedup:
+                    help_text += f"• 重复指令拦截：已拦截{self.dedup_cache.suppressed}次\n"
+                help_text += "\n💡 提示：\n"
+                help_text += "• 每人每天只能排队一次（除非配置允许重复排队）\n"
+                help_text += "• 被叫号后会自动加入已完成列表\n"
+                help_text += "• 每天定时清空队列和已完成记录\n"
+                help_text += "• 退出排队后可以重新排队"
             yield event.plain_result(help_text)
 
     async def terminate(self):
         """插件销毁方法"""
+        self.recorder.close()
         logger.info("排队系统插件已停止")
 
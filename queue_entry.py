@@ -0,0 +1,46 @@
+import sys
+
+
+def intern_value(value):
+    """驻留字符串，使同一用户ID/昵称在所有群聊和已完成列表中只保留一份"""
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+class QueueEntry:
+    """紧凑的排队条目
+
+    使用 __slots__ 避免每个条目携带一个字典，用户ID和昵称统一驻留。
+    仅在持久化和渲染时与字典互相转换。
+    条目加入队列后视为不可变，可以被多个快照共享；位置变化时用 with_position 替换为新条目。
+    """
+
+    __slots__ = ("user_id", "user_name", "position", "join_time")
+
+    def __init__(self, user_id, user_name, position, join_time):
+        self.user_id = intern_value(user_id)
+        self.user_name = intern_value(user_name)
+        self.position = position
+        self.join_time = join_time
+
+    @classmethod
+    def from_dict(cls, data):
+        """从持久化的字典恢复条目"""
+        return cls(data["user_id"], data["user_name"], data.get("position", 0), data.get("join_time", 0))
+
+    def with_position(self, position):
+        """返回位置不同的新条目，原条目保持不变"""
+        return QueueEntry(self.user_id, self.user_name, position, self.join_time)
+
+    def to_dict(self):
+        """转换为字典，用于持久化和模板渲染"""
+        return {
+            "user_id": self.user_id,
+            "user_name": self.user_name,
+            "position": self.position,
+            "join_time": self.join_time,
+        }
+
+    def __repr__(self):
+        return f"QueueEntry(user_id={self.user_id!r}, user_name={self.user_name!r}, position={self.position})"
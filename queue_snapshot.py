@@ -0,0 +1,36 @@
+# 状态图片中最多展示的排队人数
+PREVIEW_SIZE = 10
+
+
+class GroupSnapshot:
+    """群聊队列的不可变快照
+
+    每次修改完成后发布一个新快照，读取指令直接使用最新快照，无需等待正在进行的修改或渲染。
+    队列和已完成记录都以元组保存，条目本身不可变，可以与写入方的列表共享。
+    版本号与群聊数据版本一致，同时作为渲染图片缓存的键。
+    """
+
+    __slots__ = ("version", "queue", "completed", "_queue_items")
+
+    def __init__(self, version, queue, completed):
+        self.version = version
+        self.queue = tuple(queue)
+        self.completed = tuple(completed)
+        self._queue_items = None
+
+    @property
+    def queue_items(self):
+        """前 PREVIEW_SIZE 位的渲染数据，每个版本只转换一次"""
+        if self._queue_items is None:
+            self._queue_items = tuple(person.to_dict() for person in self.queue[:PREVIEW_SIZE])
+        return self._queue_items
+
+    def find(self, user_id):
+        """查找用户的排队条目，不在队列中时返回 None"""
+        for person in self.queue:
+            if person.user_id == user_id:
+                return person
+        return None
+
+
+EMPTY_SNAPSHOT = GroupSnapshot(0, (), ())
@@ -0,0 +1,69 @@
+import json
+import time
+
+# 导出文件格式版本
+EXPORT_FORMAT_VERSION = 1
+# 导入时每暂存多少条已完成记录合并一次，限制去重集合的大小
+IMPORT_COMPLETED_BATCH = 1000
+
+
+def export_header():
+    """导出文件的首行"""
+    return json.dumps({"type": "export", "version": EXPORT_FORMAT_VERSION, "exported_at": int(time.time())}) + "\n"
+
+
+def format_group_lines(group_id, queue_data, completed_data):
+    """将一个群聊的数据格式化为多行 JSON，排队条目按位置顺序输出"""
+    lines = []
+    for item in queue_data:
+        lines.append(json.dumps({
+            "type": "queue",
+            "group_id": group_id,
+            "user_id": item["user_id"],
+            "user_name": item["user_name"],
+            "join_time": item.get("join_time", 0),
+        }, ensure_ascii=False))
+    for user_name in completed_data:
+        lines.append(json.dumps({"type": "completed", "group_id": group_id, "user_name": user_name}, ensure_ascii=False))
+    return "".join(line + "\n" for line in lines)
+
+
+def parse_import_line(line):
+    """解析并校验一行导入数据
+
+    返回 None 表示应忽略的行（空行、文件头），格式错误时抛出 ValueError。
+    返回的记录中 group_id 和 user_id 统一为字符串。
+    """
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"JSON 格式错误：{e}")
+    if not isinstance(record, dict):
+        raise ValueError("每行必须是一个 JSON 对象")
+
+    record_type = record.get("type")
+    if record_type == "export":
+        return None
+    if record_type not in ("queue", "completed"):
+        raise ValueError(f"未知的记录类型：{record_type}")
+    group_id = record.get("group_id")
+    if isinstance(group_id, bool) or not isinstance(group_id, (str, int)) or group_id == "":
+        raise ValueError("group_id 必须是非空字符串或整数")
+    record["group_id"] = str(group_id)
+
+    user_name = record.get("user_name")
+    if not isinstance(user_name, str) or not user_name:
+        raise ValueError("user_name 必须是非空字符串")
+    if record_type == "queue":
+        user_id = record.get("user_id")
+        if isinstance(user_id, bool) or not isinstance(user_id, (str, int)) or user_id == "":
+            raise ValueError("user_id 必须是非空字符串或整数")
+        # 平台提供的用户ID是字符串，整数形式统一转换，12345 与 "12345" 视为同一用户
+        record["user_id"] = str(user_id)
+        join_time = record.get("join_time", 0)
+        if isinstance(join_time, bool) or not isinstance(join_time, (int, float)):
+            raise ValueError("join_time 必须是数字")
+    return record
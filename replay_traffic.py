@@ -0,0 +1,335 @@
+"""离线重放录制的指令流量
+
+用法：
+    python replay_traffic.py data/queue_system_traffic.jsonl --speed 10
+    python replay_traffic.py traffic.jsonl --speed max --kv-latency-ms 5 --render-latency-ms 80
+
+在独立进程中用桩模块替代 AstrBot，以内存键值存储和模拟渲染驱动一个插件实例，
+按录制的时间间隔（1x/10x/...）或尽可能快（max）重放指令，
+输出各指令的延迟分位数，并与录制时的队列摘要比较最终状态是否一致。
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import sys
+import time
+import types
+
+# 录制的指令名 -> 插件处理方法
+COMMAND_HANDLERS = {
+    "排队": "join_queue",
+    "退出排队": "leave_queue",
+    "查看队列": "view_queue",
+    "我的位置": "my_position",
+    "清空队列": "clear_queue",
+    "清空所有队列": "clear_all_queues",
+    "下一位": "call_next",
+    "当前叫号": "current_calling",
+    "跳过": "skip_current",
+    "排队帮助": "queue_help",
+}
+AUTO_CLEAR_COMMAND = "定时清空"
+CLEAR_ALL_COMMAND = "清空所有队列"
+# 会修改队列、但录制中缺少参数（文件名等）而无法重放的指令
+STATE_CHANGING_SKIPPED = {"导入队列"}
+
+
+class ReplayEvent:
+    """重放用的消息事件，只实现插件用到的接口"""
+
+    def __init__(self, record):
+        self.group_id = record["group"]
+        self.sender_id = record["user"]
+        self.sender_name = record.get("name", record["user"])
+        self.message_obj = types.SimpleNamespace(message_id=record.get("msg"))
+        self._extras = {}
+
+    def get_sender_id(self):
+        return self.sender_id
+
+    def get_sender_name(self):
+        return self.sender_name
+
+    def set_extra(self, key, value):
+        self._extras[key] = value
+
+    def get_extra(self, key=None):
+        return self._extras.get(key) if key else self._extras
+
+    def plain_result(self, text):
+        return ("plain", text)
+
+    def image_result(self, url):
+        return ("image", url)
+
+    def chain_result(self, chain):
+        return ("chain", chain)
+
+
+def install_astrbot_stubs():
+    """注册最小化的 astrbot.api 桩模块，使插件可以脱离 AstrBot 导入"""
+    class Filter:
+        def command(self, name, alias=None, **kwargs):
+            return lambda handler: handler
+
+    class Star:
+        def __init__(self, context):
+            self.context = context
+
+    class At:
+        def __init__(self, qq):
+            self.qq = qq
+
+    class Plain:
+        def __init__(self, text):
+            self.text = text
+
+    api = types.ModuleType("astrbot.api")
+    api.logger = logging.getLogger("queue_system_replay")
+    api.AstrBotConfig = dict
+    event = types.ModuleType("astrbot.api.event")
+    event.filter = Filter()
+    event.AstrMessageEvent = ReplayEvent
+    star = types.ModuleType("astrbot.api.star")
+    star.Context = object
+    star.Star = Star
+    star.register = lambda *args, **kwargs: (lambda cls: cls)
+    components = types.ModuleType("astrbot.api.message_components")
+    components.At = At
+    components.Plain = Plain
+    sys.modules["astrbot"] = types.ModuleType("astrbot")
+    sys.modules["astrbot.api"] = api
+    sys.modules["astrbot.api.event"] = event
+    sys.modules["astrbot.api.star"] = star
+    sys.modules["astrbot.api.message_components"] = components
+
+
+def load_plugin_class():
+    """以包的形式导入插件（main.py 使用相对导入）"""
+    install_astrbot_stubs()
+    package = types.ModuleType("queue_system_replay")
+    package.__path__ = [os.path.dirname(os.path.abspath(__file__))]
+    sys.modules["queue_system_replay"] = package
+    module = importlib.import_module("queue_system_replay.main")
+    return module.QueuePlugin, module
+
+
+def make_replay_plugin(plugin_class, config, kv_latency, render_latency):
+    """创建使用内存键值存储和模拟渲染的插件实例"""
+    class ReplayPlugin(plugin_class):
+        def __init__(self):
+            self.kv = {}
+            super().__init__(None, config)
+
+        async def get_kv_data(self, key, default):
+            if kv_latency:
+                await asyncio.sleep(kv_latency)
+            return json.loads(self.kv[key]) if key in self.kv else default
+
+        async def put_kv_data(self, key, value):
+            if kv_latency:
+                await asyncio.sleep(kv_latency)
+            self.kv[key] = json.dumps(value, ensure_ascii=False)
+
+        async def delete_kv_data(self, key):
+            if kv_latency:
+                await asyncio.sleep(kv_latency)
+            self.kv.pop(key, None)
+
+        async def html_render(self, template, data):
+            payload = json.dumps(data, ensure_ascii=False)
+            if render_latency:
+                await asyncio.sleep(render_latency)
+            return f"replay://render/{len(payload)}"
+
+    return ReplayPlugin()
+
+
+def read_recording(path):
+    """读取录制文件，返回 (session, commands)，指令按时间戳排序"""
+    session = {}
+    commands = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if record.get("type") == "session":
+                if session and any(session.get(k) != v for k, v in record.items() if k not in ("type", "ts")):
+                    logging.warning("录制文件包含多个配置不同的会话，使用第一个会话的配置")
+                session = session or record
+            elif record.get("type") == "command":
+                commands.append(record)
+    commands.sort(key=lambda record: record["ts"])
+    return session, commands
+
+
+def build_config(session, commands):
+    """根据录制会话还原影响队列状态的配置"""
+    return {
+        "max_queue_size": session.get("max_queue_size", 50),
+        "allow_requeue": session.get("allow_requeue", False),
+        "enable_call_permission": session.get("enable_call_permission", False),
+        "call_permission_users": sorted({r["user"] for r in commands if r.get("can_call")}),
+        "admin_users": sorted({r["user"] for r in commands if r.get("admin")}),
+        # 重放会压缩时间，时间窗口去重改为按消息ID重现（见 prepare_duplicates）
+        "dedup_window_seconds": 0,
+        "max_cached_groups": 0,
+    }
+
+
+def split_replayable(commands):
+    """分出可以重放的指令，返回 (可重放的指令, {指令名: 跳过次数})"""
+    replayable = []
+    skipped = {}
+    for record in commands:
+        if record["cmd"] == AUTO_CLEAR_COMMAND or record["cmd"] in COMMAND_HANDLERS:
+            replayable.append(record)
+        else:
+            skipped[record["cmd"]] = skipped.get(record["cmd"], 0) + 1
+    return replayable, skipped
+
+
+def prepare_duplicates(commands):
+    """让录制时被拦截的重复指令在重放时同样被拦截
+
+    按消息ID判定的重复会自然重现；按时间窗口判定的重复，改用同一用户上一条同名指令的消息ID。
+    """
+    last_message = {}
+    for record in commands:
+        key = (record["group"], record["user"], record["cmd"])
+        if record.get("dup") and key in last_message:
+            record["msg"] = last_message[key]
+        if not record.get("msg"):
+            record["msg"] = f"replay-{id(record)}"
+        last_message[key] = record["msg"]
+
+
+async def run_command(plugin, record, latencies):
+    started = time.perf_counter()
+    if record["cmd"] == AUTO_CLEAR_COMMAND:
+        await plugin.clear_all_queues_task()
+    else:
+        handler = getattr(plugin, COMMAND_HANDLERS[record["cmd"]])
+        async for _ in handler(ReplayEvent(record)):
+            pass
+    latencies.setdefault(record["cmd"], []).append(time.perf_counter() - started)
+
+
+async def replay(plugin, commands, speed):
+    """按倍速重放；speed 为 None 时逐条尽快执行"""
+    latencies = {}
+    if speed is None:
+        for record in commands:
+            await run_command(plugin, record, latencies)
+        return latencies
+
+    origin = commands[0]["ts"] if commands else 0
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    tasks = []
+    for record in commands:
+        delay = start + (record["ts"] - origin) / speed - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(run_command(plugin, record, latencies)))
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def clears_all_groups(record):
+    """定时清空和高级管理员成功执行的 /清空所有队列 会清空所有群聊，而录制中只有发送指令的群聊的摘要"""
+    if record["cmd"] == AUTO_CLEAR_COMMAND:
+        return True
+    return record["cmd"] == CLEAR_ALL_COMMAND and record.get("admin") and not record.get("dup")
+
+
+def compare_final_state(plugin, digest, commands):
+    """比较每个群聊最后一条指令记录的摘要与重放后的状态，返回 (一致数, 不一致的群聊列表)"""
+    expected = {}
+    for record in commands:
+        if clears_all_groups(record):
+            expected = {group: (digest([]), digest([])) for group in expected}
+            if record["cmd"] == AUTO_CLEAR_COMMAND:
+                continue
+        expected[record["group"]] = (record["queue_digest"], record["completed_digest"])
+    matched = 0
+    mismatched = []
+    for group, (queue_digest, completed_digest) in expected.items():
+        queue = plugin.queues.get(group, [])
+        completed = plugin.completed_users.get(group, [])
+        actual = (digest([person.user_id for person in queue]), digest(list(completed)))
+        if actual == (queue_digest, completed_digest):
+            matched += 1
+        else:
+            mismatched.append(group)
+    return matched, mismatched
+
+
+async def main_async(args):
+    plugin_class, module = load_plugin_class()
+    session, commands = read_recording(args.recording)
+    replayable, skipped = split_replayable(commands)
+    if skipped:
+        print("跳过无法重放的指令：" + "，".join(f"/{command} {count} 次" for command, count in skipped.items()))
+        if STATE_CHANGING_SKIPPED & set(skipped):
+            print("提示：跳过的指令会修改队列，最终状态比较可能出现不一致")
+    if not replayable:
+        print("录制文件中没有可重放的指令记录")
+        return 1
+    prepare_duplicates(replayable)
+
+    config = build_config(session, commands)
+    plugin = make_replay_plugin(plugin_class, config, args.kv_latency_ms / 1000, args.render_latency_ms / 1000)
+    await plugin.initialize()
+
+    speed = None if args.speed == "max" else float(args.speed.rstrip("x"))
+    started = time.perf_counter()
+    latencies = await replay(plugin, replayable, speed)
+    elapsed = time.perf_counter() - started
+
+    span = replayable[-1]["ts"] - replayable[0]["ts"]
+    print(f"重放 {len(replayable)} 条指令，录制时长 {span:.1f}s，重放耗时 {elapsed:.2f}s（速度 {args.speed}）")
+    print(f"{'指令':<10}{'次数':>8}{'p50(ms)':>10}{'p90(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+    all_latencies = []
+    for command, values in sorted(latencies.items(), key=lambda item: -len(item[1])):
+        all_latencies.extend(values)
+        print(f"{command:<10}{len(values):>8}"
+              f"{percentile(values, 0.5) * 1000:>10.2f}{percentile(values, 0.9) * 1000:>10.2f}"
+              f"{percentile(values, 0.99) * 1000:>10.2f}{max(values) * 1000:>10.2f}")
+    print(f"{'全部':<10}{len(all_latencies):>8}"
+          f"{percentile(all_latencies, 0.5) * 1000:>10.2f}{percentile(all_latencies, 0.9) * 1000:>10.2f}"
+          f"{percentile(all_latencies, 0.99) * 1000:>10.2f}{max(all_latencies) * 1000:>10.2f}")
+
+    matched, mismatched = compare_final_state(plugin, module.TrafficRecorder.digest, commands)
+    print(f"最终状态：{matched} 个群聊一致，{len(mismatched)} 个群聊不一致")
+    if mismatched:
+        print("不一致的群聊：" + ", ".join(mismatched[:20]) + (" ..." if len(mismatched) > 20 else ""))
+        print("提示：录制开始时队列不为空，或重放配置与录制时不同，都会导致不一致")
+    return 0 if not mismatched else 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线重放排队系统插件录制的指令流量")
+    parser.add_argument("recording", help="录制文件路径（traffic_record_file）")
+    parser.add_argument("--speed", default="1", help="重放速度：1、10 等倍速，或 max 表示逐条尽快执行")
+    parser.add_argument("--kv-latency-ms", type=float, default=0, help="模拟键值存储每次读写的延迟（毫秒）")
+    parser.add_argument("--render-latency-ms", type=float, default=0, help="模拟图片渲染的延迟（毫秒）")
+    parser.add_argument("--verbose", action="store_true", help="输出插件日志")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    return asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
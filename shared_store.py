@@ -0,0 +1,135 @@
+import json
+import os
+import sqlite3
+
+
+class SharedQueueStore:
+    """多进程共享的本地队列存储（SQLite）
+
+    每个群聊一行，带有版本号。提交时比较版本号实现乐观并发控制：
+    版本不一致说明其他进程已修改该群聊，提交失败，由调用方重新加载后重试。
+    版本号取自全局递增序列，删除后重建的群聊不会复用旧版本号。
+    所有方法都是阻塞调用，应放到线程池中执行。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS queue_groups ("
+                "group_id TEXT PRIMARY KEY, "
+                "version INTEGER NOT NULL, "
+                "queue TEXT NOT NULL, "
+                "completed TEXT NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS queue_meta ("
+                "key TEXT PRIMARY KEY, "
+                "value INTEGER NOT NULL)"
+            )
+            conn.execute("INSERT OR IGNORE INTO queue_meta (key, value) VALUES ('version_seq', 0)")
+
+    def _connect(self):
+        # isolation_level=None：由我们显式控制事务，BEGIN IMMEDIATE 会获取数据库文件的写锁
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return _ClosingConnection(conn)
+
+    def get_version(self, group_id):
+        """获取群聊当前版本号，不存在时返回 0"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT version FROM queue_groups WHERE group_id = ?", (str(group_id),)).fetchone()
+        return row[0] if row else 0
+
+    def load_group(self, group_id):
+        """加载单个群聊，返回 (version, queue, completed)，不存在时返回空数据"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT version, queue, completed FROM queue_groups WHERE group_id = ?", (str(group_id),)
+            ).fetchone()
+        if not row:
+            return 0, [], []
+        return row[0], json.loads(row[1]), json.loads(row[2])
+
+    def load_group_if_changed(self, group_id, known_version):
+        """版本与 known_version 不同时加载群聊，返回 (version, queue, completed)，否则返回 None
+
+        每次读取都会调用，先只查询版本号，版本变化时才读取队列数据。
+        """
+        if self.get_version(group_id) == known_version:
+            return None
+        version, queue, completed = self.load_group(group_id)
+        # 两次查询之间可能又被修改，以实际读到的版本为准
+        if version == known_version:
+            return None
+        return version, queue, completed
+
+    def list_group_ids(self):
+        """列出所有群聊ID"""
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute("SELECT group_id FROM queue_groups ORDER BY group_id")]
+
+    def commit_group(self, group_id, expected_version, queue, completed):
+        """以乐观并发方式提交群聊数据
+
+        当前版本与 expected_version 一致时写入并返回新版本号，否则返回 None。
+        队列和已完成记录都为空时删除该群聊。
+        """
+        group_id = str(group_id)
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT version FROM queue_groups WHERE group_id = ?", (group_id,)).fetchone()
+                current_version = row[0] if row else 0
+                if current_version != expected_version:
+                    conn.execute("ROLLBACK")
+                    return None
+                new_version = self._next_version(conn)
+                if not queue and not completed:
+                    # 空群聊不再保存
+                    conn.execute("DELETE FROM queue_groups WHERE group_id = ?", (group_id,))
+                    conn.execute("COMMIT")
+                    return new_version
+                conn.execute(
+                    "INSERT INTO queue_groups (group_id, version, queue, completed) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(group_id) DO UPDATE SET "
+                    "version = excluded.version, queue = excluded.queue, completed = excluded.completed",
+                    (group_id, new_version, json.dumps(queue, ensure_ascii=False), json.dumps(completed, ensure_ascii=False)),
+                )
+                conn.execute("COMMIT")
+                return new_version
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def clear_all(self):
+        """清空所有群聊的数据"""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM queue_groups")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _next_version(self, conn):
+        """在当前事务中取下一个全局版本号"""
+        conn.execute("UPDATE queue_meta SET value = value + 1 WHERE key = 'version_seq'")
+        return conn.execute("SELECT value FROM queue_meta WHERE key = 'version_seq'").fetchone()[0]
+
+
+class _ClosingConnection:
+    """离开 with 语句时关闭连接（sqlite3.Connection 自身的上下文管理器只提交不关闭）"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, *exc_info):
+        self.conn.close()
+        return False
@@ -0,0 +1,107 @@
+"""多进程共享状态的并发测试
+
+用法：
+    python stress_shared_state.py
+    python stress_shared_state.py --processes 6 --users 60 --call-every 3
+
+启动多个进程，各自以 enable_shared_state 模式运行一个插件实例，对同一个群聊并发执行
+/排队 和 /下一位。全部结束后检查共享存储：每个排队的用户要么仍在队列中，要么恰好被叫号一次，
+且排队位置连续，以此证明没有更新丢失。全部通过时退出码为 0，否则为 1。
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from replay_traffic import ReplayEvent, load_plugin_class, make_replay_plugin
+
+GROUP_ID = "stress"
+
+
+def make_event(user_id):
+    return ReplayEvent({"group": GROUP_ID, "user": user_id, "name": f"name-{user_id}"})
+
+
+async def run_worker(worker_id, db_path, users, call_every):
+    """依次让 users 个用户排队，每 call_every 人叫号一次，返回被叫到的用户ID"""
+    plugin_class, _ = load_plugin_class()
+    config = {
+        "enable_shared_state": True,
+        "shared_state_path": db_path,
+        "max_queue_size": 1000000,
+        "dedup_window_seconds": 0,
+    }
+    plugin = make_replay_plugin(plugin_class, config, 0, 0)
+    await plugin.initialize()
+    called = []
+    for i in range(users):
+        async for _ in plugin.join_queue(make_event(f"w{worker_id}-{i}")):
+            pass
+        if i % call_every == 0:
+            called_this_round = False
+            async for result in plugin.call_next(make_event(f"admin{worker_id}")):
+                # 完整消费回复，提前关闭生成器会触发叫号回退分支
+                if result[0] == "chain" and not called_this_round:
+                    called.append(result[1][0].qq)
+                    called_this_round = True
+    return called
+
+
+def worker(worker_id, db_path, users, call_every):
+    logging.disable(logging.WARNING)
+    return asyncio.run(run_worker(worker_id, db_path, users, call_every))
+
+
+def check(store, results, processes, users):
+    """检查共享存储中的最终状态，返回问题描述列表"""
+    _, queue, completed = store.load_group(GROUP_ID)
+    called = [user_id for worker_called in results for user_id in worker_called]
+    queued = [item["user_id"] for item in queue]
+    expected = {f"w{w}-{i}" for w in range(processes) for i in range(users)}
+
+    problems = []
+    if len(called) != len(set(called)):
+        problems.append(f"有用户被重复叫号：{len(called) - len(set(called))} 次")
+    if len(queued) != len(set(queued)):
+        problems.append(f"队列中有重复用户：{len(queued) - len(set(queued))} 人")
+    if set(called) & set(queued):
+        problems.append(f"已叫号的用户仍在队列中：{len(set(called) & set(queued))} 人")
+    lost = expected - set(called) - set(queued)
+    if lost:
+        problems.append(f"丢失的排队用户：{len(lost)} 人")
+    if len(completed) != len(called):
+        problems.append(f"已完成记录数 {len(completed)} 与叫号次数 {len(called)} 不一致")
+    if [item["position"] for item in queue] != list(range(1, len(queue) + 1)):
+        problems.append("排队位置不连续")
+    print(f"{processes} 个进程，{len(expected)} 人排队，叫号 {len(called)} 次，队列剩余 {len(queued)} 人")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多进程共享状态的并发测试")
+    parser.add_argument("--processes", type=int, default=6, help="并发进程数")
+    parser.add_argument("--users", type=int, default=60, help="每个进程排队的用户数")
+    parser.add_argument("--call-every", type=int, default=3, help="每多少人排队后叫号一次")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "shared.db")
+        with multiprocessing.Pool(args.processes) as pool:
+            results = pool.starmap(worker, [(w, db_path, args.users, args.call_every) for w in range(args.processes)])
+        _, module = load_plugin_class()
+        problems = check(module.SharedQueueStore(db_path), results, args.processes, args.users)
+
+    if problems:
+        for problem in problems:
+            print(f"❌ {problem}")
+        return 1
+    print("✅ 没有丢失或重复的更新")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
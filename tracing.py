@@ -0,0 +1,142 @@
+import contextvars
+import itertools
+import json
+import os
+import random
+import time
+
+# 当前协程（及其派生任务）所属的采样链路
+_current_trace = contextvars.ContextVar("queue_system_trace", default=None)
+
+
+class _NoopSpan:
+    """未采样时使用的空跨度，进入和退出都不做任何事"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """一次指令处理的采样链路，结束时一次性写出所有跨度"""
+
+    __slots__ = ("trace_id", "name", "events", "root")
+
+    def __init__(self, trace_id, name, args):
+        self.trace_id = trace_id
+        self.name = name
+        self.events = []
+        self.root = _Span(self, name, args or None)
+
+
+class _Span:
+    """记录一段耗时，退出时生成 Chrome trace 的完整事件（ph = X）"""
+
+    __slots__ = ("trace", "name", "args", "start")
+
+    def __init__(self, trace, name, args):
+        self.trace = trace
+        self.name = name
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        event = {
+            "name": self.name,
+            "ph": "X",
+            "ts": round(self.start * 1e6, 3),
+            "dur": round((end - self.start) * 1e6, 3),
+            "pid": os.getpid(),
+            "tid": self.trace.trace_id,
+        }
+        if exc_type is not None:
+            self.args = dict(self.args or {}, error=exc_type.__name__)
+        if self.args:
+            event["args"] = self.args
+        self.trace.events.append(event)
+        return False
+
+
+class Tracer:
+    """按采样率记录指令处理各阶段的耗时，输出为 Chrome trace-event JSON
+
+    文件使用 JSON 数组格式逐行追加（结尾的 ] 可以省略），可直接用 chrome://tracing
+    或 Perfetto 打开。超过 max_bytes 时轮转为 .1、.2 ... 备份。
+    未启用或未采样时 span() 返回共享的空跨度，开销只有一次上下文变量读取。
+    """
+
+    def __init__(self, enabled=False, sample_rate=0.1, path="data/queue_system_trace.json", max_bytes=10 * 1024 * 1024, backup_count=3):
+        self.enabled = enabled
+        self.sample_rate = max(0.0, min(1.0, float(sample_rate)))
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._trace_ids = itertools.count(1)
+
+    def start_trace(self, name, **args):
+        """按采样率开始一条链路，未采样时返回 None"""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        trace = Trace(next(self._trace_ids), name, args)
+        _current_trace.set(trace)
+        trace.root.__enter__()
+        return trace
+
+    def finish_trace(self, trace):
+        """结束链路并写出所有跨度"""
+        _current_trace.set(None)
+        trace.root.__exit__(None, None, None)
+        events = [{
+            "name": "thread_name",
+            "ph": "M",
+            "pid": os.getpid(),
+            "tid": trace.trace_id,
+            "args": {"name": f"{trace.name} #{trace.trace_id}"},
+        }]
+        # 根跨度放在最前，便于查看器按嵌套关系排列
+        events.append(trace.events.pop())
+        events.extend(trace.events)
+        self._write(events)
+
+    def span(self, name, **args):
+        """在当前链路中记录一个阶段，当前协程未被采样时返回空跨度"""
+        if not self.enabled:
+            return _NOOP_SPAN
+        trace = _current_trace.get()
+        if trace is None:
+            return _NOOP_SPAN
+        return _Span(trace, name, args or None)
+
+    def _write(self, events):
+        data = "".join(json.dumps(event, ensure_ascii=False) + ",\n" for event in events)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.max_bytes:
+            self._rotate()
+        is_new = not os.path.exists(self.path)
+        with open(self.path, "a", encoding="utf-8") as f:
+            if is_new:
+                f.write("[\n")
+            f.write(data)
+
+    def _rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
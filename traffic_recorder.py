@@ -0,0 +1,69 @@
+import hashlib
+import json
+import os
+import time
+
+
+class TrafficRecorder:
+    """记录匿名化的指令流量，供 replay_traffic.py 离线重放
+
+    每行一个 JSON 对象。每次打开文件时先写入一行 session 记录（影响队列状态的配置），
+    之后每条指令一行 command 记录：时间戳、群聊、匿名化的用户、指令名以及执行后的队列摘要。
+    用户ID、昵称和消息ID都经过加盐哈希，同一个盐下同一用户的哈希值保持一致。
+    """
+
+    def __init__(self, enabled=False, path="data/queue_system_traffic.jsonl", salt="", session=None):
+        self.enabled = enabled
+        self.path = path
+        self.salt = salt
+        self.session = session or {}
+        self._file = None
+
+    def anonymize(self, value):
+        """加盐哈希，返回16位十六进制字符串"""
+        return hashlib.sha256(f"{self.salt}:{value}".encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def digest(values):
+        """计算有序列表的摘要，用于比较重放后的队列是否一致"""
+        return hashlib.sha1("\n".join(values).encode("utf-8")).hexdigest()[:16]
+
+    def record(self, ts, group_id, user_id, user_name, command, message_id=None, duplicate=False,
+               can_call=False, is_admin=False, queue=(), completed=()):
+        """记录一条指令及其执行后的群聊队列摘要"""
+        if not self.enabled:
+            return
+        event = {
+            "type": "command",
+            "ts": round(ts, 6),
+            "group": str(group_id),
+            "user": self.anonymize(user_id),
+            "name": self.anonymize(user_name),
+            "cmd": command,
+            "dur": round(time.time() - ts, 6),
+            "queue_digest": self.digest([self.anonymize(person.user_id) for person in queue]),
+            "completed_digest": self.digest([self.anonymize(name) for name in completed]),
+        }
+        if message_id:
+            event["msg"] = self.anonymize(message_id)
+        if duplicate:
+            event["dup"] = True
+        if can_call:
+            event["can_call"] = True
+        if is_admin:
+            event["admin"] = True
+        self._write(event)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _write(self, event):
+        if self._file is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(json.dumps(dict(self.session, type="session", ts=round(time.time(), 6)), ensure_ascii=False) + "\n")
+        self._file.write(json.dumps(event, ensure_ascii=False) + "\n")
+        self._file.flush()